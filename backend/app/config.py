@@ -16,16 +16,36 @@ class Settings(BaseSettings):
     
     # LLM APIs
     llama_cloud_api_key: str = os.getenv("LLAMA_CLOUD_API_KEY", "")
+    llama_cloud_base_url: str = os.getenv("LLAMA_CLOUD_BASE_URL", "https://api.cloud.llamaindex.ai")
+    # LlamaParse job submissions allowed per minute across all workers
+    llamaparse_rpm: int = int(os.getenv("LLAMAPARSE_RPM", "60"))
     google_api_key: str = os.getenv("GOOGLE_API_KEY", "")
     
+    # Gemini models for metadata extraction (fallback is used on retries)
+    gemini_model: str = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+    gemini_fallback_model: str = os.getenv("GEMINI_FALLBACK_MODEL", "gemini-2.5-flash")
+    
     # Processing settings
     chunk_size: int = 1024
     chunk_overlap: int = 200
     max_concurrent_processes: int = 3
+    # Files processed at once; mostly waiting on LlamaParse, embeddings and Gemini
+    max_concurrent_files: int = int(os.getenv("MAX_CONCURRENT_FILES", "32"))
+    # Files waiting or in flight before uploads are rejected with 503
+    queue_max_depth: int = int(os.getenv("QUEUE_MAX_DEPTH", "200"))
     
     # ChromaDB settings
     chroma_persist_directory: str = os.getenv("CHROMA_PERSIST_DIRECTORY", "chroma_db")
     
+    # SQLite file caching chunk embeddings by content hash
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+    
+    # Extracted PDF text, cached by content hash so duplicate uploads skip LlamaParse
+    parse_cache_directory: str = os.getenv("PARSE_CACHE_DIRECTORY", "parse_cache")
+    
+    # Last fetched exchange rates, so a restart within the TTL doesn't refetch them
+    exchange_rate_cache_path: str = os.getenv("EXCHANGE_RATE_CACHE_PATH", "exchange_rates.json")
+    
     # File upload settings
     max_file_size: int = 50 * 1024 * 1024  # 50MB
     allowed_extensions: List[str] = [".pdf",".docx",".doc"]
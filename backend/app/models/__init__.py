@@ -25,6 +25,9 @@ class File(Base):
     metadata_processing_error = Column(Text, nullable=True)
     processing_attempts = Column(Integer, default=0)
     
+    # Hash of the PDF bytes; re-uploads of a processed file reuse its vectors and metadata
+    content_hash = Column(String, nullable=True, index=True)
+    
     # Relationships
     file_metadata = relationship("FileMetadata", back_populates="file", uselist=False)
 
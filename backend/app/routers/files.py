@@ -44,6 +44,14 @@ async def upload_files(
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
+    # Push back before storing anything when the processing queue is saturated
+    if processing_queue and processing_queue.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="Processing queue is full, try again later",
+            headers={"Retry-After": "30"}
+        )
+    
     uploaded_files = []
     failed_uploads = []
     
@@ -59,31 +67,57 @@ async def upload_files(
                 
             await _validate_file(file)
             
-            # Read file content
-            file_content = await file.read()
-            
-            # Upload to Cloudinary
-            cloudinary_result = await cloudinary_service.upload_file(file_content, file.filename)
-            
-            # Create database record
-            file_id = str(uuid.uuid4())
-            db_file = File(
-                id=file_id,
-                filename=file.filename,
-                cloudinary_url=cloudinary_result["secure_url"],
-                cloudinary_public_id=cloudinary_result["public_id"],
-                file_size=len(file_content),
-                upload_timestamp=datetime.utcnow(),
-                vector_processing_status="pending",
-                metadata_processing_status="pending"
-            )
+            # Hold a queue slot before storing anything, so the queue can't fill up between
+            # the Cloudinary upload and queueing the file
+            if processing_queue and not processing_queue.try_reserve():
+                failed_uploads.append({
+                    "filename": file.filename,
+                    "error": "Processing queue is full, try again later"
+                })
+                continue
             
-            db.add(db_file)
-            await db.commit()
+            try:
+                # Read file content
+                file_content = await file.read()
+                
+                # Upload to Cloudinary
+                cloudinary_result = await cloudinary_service.upload_file(file_content, file.filename)
+                
+                # Create database record
+                file_id = str(uuid.uuid4())
+                db_file = File(
+                    id=file_id,
+                    filename=file.filename,
+                    cloudinary_url=cloudinary_result["secure_url"],
+                    cloudinary_public_id=cloudinary_result["public_id"],
+                    file_size=len(file_content),
+                    upload_timestamp=datetime.utcnow(),
+                    vector_processing_status="pending",
+                    metadata_processing_status="pending"
+                )
+                
+                db.add(db_file)
+                await db.commit()
+            except Exception:
+                if processing_queue:
+                    processing_queue.release_reservation()
+                raise
             
             # Add to processing queue
             if processing_queue:
-                await processing_queue.add_file_for_processing(file_id, file_content, file.filename)
+                try:
+                    await processing_queue.add_file_for_processing(
+                        file_id, file_content, file.filename, reserved=True
+                    )
+                except Exception as e:
+                    # Don't leave a pending row that nothing will process
+                    error_message = f"Failed to queue file for processing: {str(e)}"
+                    db_file.vector_processing_status = "failed"
+                    db_file.metadata_processing_status = "failed"
+                    db_file.vector_processing_error = error_message
+                    db_file.metadata_processing_error = error_message
+                    await db.commit()
+                    raise
             
             uploaded_files.append(FileUploadResponse(
                 file_id=file_id,
@@ -282,6 +316,10 @@ async def delete_file(
         from app.services.vector_processing import vector_processing_service
         await vector_processing_service.delete_file_vectors(file_id)
         
+        # Delete the extracted text cached for this content
+        from app.services.pdf_processing import pdf_processing_service
+        await pdf_processing_service.remove_cached_text(file.content_hash)
+        
         # Delete from database (cascade will handle metadata and errors)
         await db.delete(file)
         await db.commit()
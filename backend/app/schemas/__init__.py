@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 from typing import Optional, List
 from enum import Enum
@@ -34,6 +34,72 @@ class ScopeOfServices(str, Enum):
     OTHER = "Other"
     NA = "NA"
 
+# Valid values accepted by ContractMetadata ("NA" falls back to "Other" for type/scope)
+_VALID_CONTRACT_STATUSES = frozenset(s.value for s in ContractStatus)
+_VALID_CONTRACT_TYPES = frozenset(t.value for t in ContractType if t is not ContractType.NA)
+_VALID_SCOPE_TYPES = frozenset(s.value for s in ScopeOfServices if s is not ScopeOfServices.NA)
+
+# Controlled-vocabulary fields -> (valid values, fallback)
+_CHOICE_FIELDS = {
+    "contract_status": (_VALID_CONTRACT_STATUSES, ContractStatus.NA.value),
+    "contract_type": (_VALID_CONTRACT_TYPES, ContractType.OTHER.value),
+    "scope_of_services": (_VALID_SCOPE_TYPES, ScopeOfServices.OTHER.value),
+}
+
+class ContractMetadata(BaseModel):
+    """
+    Cleaned metadata produced by the extraction service.
+    Missing/empty values become "NA", everything else is coerced to a string.
+    """
+    contract_name: str = "NA"
+    start_date: str = "NA"
+    end_date: str = "NA"
+    vendor_name: str = "NA"
+    contract_duration: str = "NA"
+    contract_value_local: str = "NA"
+    currency: str = "NA"
+    contract_value_usd: str = "NA"
+    contract_status: ContractStatus = ContractStatus.NA
+    contract_type: ContractType = ContractType.OTHER
+    scope_of_services: ScopeOfServices = ScopeOfServices.OTHER
+    contract_tag: str = "NA"
+    contract_value: str = "NA"  # Legacy field for backward compatibility
+    
+    # Commercial terms fields
+    auto_renewal: str = "NA"
+    payment_terms: str = "NA"
+    liability_cap: str = "NA"
+    termination_for_convenience: str = "NA"
+    price_escalation: str = "NA"
+    
+    class Config:
+        extra = "allow"  # Risk scores and any other LLM fields pass through
+        use_enum_values = True
+        validate_default = True
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _coerce_values(cls, data):
+        # Single pass: normalize each value and check controlled vocabularies as we go
+        if not isinstance(data, dict):
+            return data
+        cleaned = {}
+        for key, value in data.items():
+            if value is None:
+                value = "NA"
+            elif isinstance(value, str):
+                # isspace() checks in place instead of allocating a stripped copy
+                if not value or value.isspace():
+                    value = "NA"
+            else:
+                value = str(value)
+            
+            choices = _CHOICE_FIELDS.get(key)
+            if choices is not None and value not in choices[0]:
+                value = choices[1]
+            cleaned[key] = value
+        return cleaned
+
 class FileUploadResponse(BaseModel):
     file_id: str
     filename: str
@@ -4,6 +4,7 @@ from app.config import settings
 import logging
 from typing import Optional
 import aiofiles
+import httpx
 import os
 import tempfile
 import re
@@ -101,6 +102,19 @@ class CloudinaryService:
             logger.error(f"Error uploading {filename} to Cloudinary: {str(e)}")
             raise Exception(f"Failed to upload file to Cloudinary: {str(e)}")
     
+    async def download_file(self, url: str) -> bytes:
+        """
+        Download a previously uploaded file's bytes
+        """
+        try:
+            async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
+                response = await client.get(url)
+                response.raise_for_status()
+                return response.content
+        except Exception as e:
+            logger.error(f"Error downloading {url} from Cloudinary: {str(e)}")
+            raise Exception(f"Failed to download file from Cloudinary: {str(e)}")
+    
     async def delete_file(self, public_id: str) -> bool:
         """
         Delete file from Cloudinary
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Job states after which polling stops
+FAILED_JOB_STATES = {"ERROR", "CANCELED"}
+SUCCEEDED_JOB_STATES = {"SUCCESS", "PARTIAL_SUCCESS"}
+
+class LlamaParseJobTracker:
+    """
+    Submits parse jobs to the LlamaParse REST API and resolves them from one shared poller.
+    A submission returns as soon as the upload is accepted; a single background task then
+    checks every pending job per tick, so in-flight parses cost a future each rather than
+    a coroutine sleeping in its own poll loop.
+    """
+
+    def __init__(self, api_key: str, base_url: str, parse_options: Dict[str, Any],
+                 poll_interval: float = 2.0, job_timeout: float = 900.0):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=60.0,
+        )
+        self.parse_options = parse_options
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+
+        # job_id -> (future resolved with the markdown text, submission time)
+        self.pending: Dict[str, tuple] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+
+    async def parse(self, file_path: str, parse_options: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Upload a file as a new parse job and wait for its markdown
+        """
+        job_id = await self._submit(file_path, parse_options or self.parse_options)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job_id] = (future, time.monotonic())
+        logger.info(f"Submitted LlamaParse job {job_id} for {os.path.basename(file_path)}")
+
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll())
+
+        try:
+            return await future
+        finally:
+            self.pending.pop(job_id, None)
+
+    async def close(self):
+        """Stop polling and close the HTTP client"""
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        await self.client.aclose()
+
+    async def _submit(self, file_path: str, parse_options: Dict[str, Any]) -> str:
+        """Upload the file and return the job id"""
+        file_content = await asyncio.to_thread(self._read_file, file_path)
+        # Form fields are strings; booleans go over the wire as "true" / "false"
+        data = {
+            key: str(value).lower() if isinstance(value, bool) else str(value)
+            for key, value in parse_options.items()
+        }
+        response = await self.client.post(
+            "/api/parsing/upload",
+            files={"file": (os.path.basename(file_path), file_content, "application/pdf")},
+            data=data,
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _read_file(self, file_path: str) -> bytes:
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    async def _poll(self):
+        """Check every pending job once per tick until none are left"""
+        while self.pending:
+            await asyncio.sleep(self.poll_interval)
+            await asyncio.gather(
+                *[self._check_job(job_id) for job_id in list(self.pending)],
+                return_exceptions=True
+            )
+
+    async def _check_job(self, job_id: str):
+        """Resolve the job's future if it has finished or timed out"""
+        entry = self.pending.get(job_id)
+        if entry is None:
+            return
+        future, submitted_at = entry
+        if future.done():
+            return
+
+        if time.monotonic() - submitted_at > self.job_timeout:
+            future.set_exception(
+                asyncio.TimeoutError(f"LlamaParse job {job_id} did not finish in {self.job_timeout:.0f}s")
+            )
+            return
+
+        try:
+            response = await self.client.get(f"/api/parsing/job/{job_id}")
+            response.raise_for_status()
+            job = response.json()
+            status = job.get("status")
+
+            if status in SUCCEEDED_JOB_STATES:
+                result = await self.client.get(f"/api/parsing/job/{job_id}/result/markdown")
+                result.raise_for_status()
+                if not future.done():
+                    future.set_result(result.json().get("markdown", ""))
+            elif status in FAILED_JOB_STATES:
+                if not future.done():
+                    error = job.get("error_message") or job.get("error_code") or status
+                    future.set_exception(Exception(f"LlamaParse job {job_id} failed: {error}"))
+
+        except httpx.HTTPError as e:
+            # Transient poll failures leave the job pending for the next tick
+            logger.warning(f"Failed to poll LlamaParse job {job_id}: {str(e)}")
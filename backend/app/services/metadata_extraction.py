@@ -1,204 +1,184 @@
 import google.generativeai as genai
 from app.config import settings
+from app.schemas import ContractMetadata
+from app.utils.exceptions import ProcessingException
 import logging
 from typing import Dict, Optional, Any
 import json
+import orjson
 import re
 import asyncio
+import hashlib
+import calendar
+import bisect
+import random
+from collections import OrderedDict
 from datetime import datetime, timedelta
-import requests
+from types import SimpleNamespace
+from functools import lru_cache, cached_property
+import os
+import httpx
+import tiktoken
+from google.api_core import exceptions as google_exceptions
 
 logger = logging.getLogger(__name__)
 
-# Configure Google Generative AI
-genai.configure(api_key=settings.google_api_key)
+# Patterns compiled once at import rather than on every call
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+# Every date shape _normalize_date understands, classified with a single match.
+# Alternatives are ordered by how often Gemini returns them - the prompt asks for DD-MM-YYYY.
+_DATE_RE = re.compile(
+    r'^(?:'
+    # 31-12-2024, 12-31-2024, 31/12/2024, 12/31/2024, 31.12.2024
+    r'(?P<num_a>\d{1,2})(?P<num_sep>[-/.])(?P<num_b>\d{1,2})(?P=num_sep)(?P<num_y>\d{4})'
+    # 2024-12-31, 2024/12/31, 2024.12.31
+    r'|(?P<ymd_y>\d{4})(?P<ymd_sep>[-/.])(?P<ymd_m>\d{1,2})(?P=ymd_sep)(?P<ymd_d>\d{1,2})'
+    # December 31, 2024 / Dec 31st, 2024
+    r'|(?P<mdy_month>[a-z]+)\s+(?P<mdy_d>\d{1,2})(?:st|nd|rd|th)?,\s+(?P<mdy_y>\d{4})'
+    # 31 December 2024 / 31st Dec 2024
+    r'|(?P<dmy_d>\d{1,2})(?:st|nd|rd|th)?\s+(?P<dmy_month>[a-z]+)\s+(?P<dmy_y>\d{4})'
+    r')$',
+    re.IGNORECASE,
+)
+# The exact shape _normalize_date emits; anything looser goes through strptime
+_DDMMYYYY_RE = re.compile(r'(\d{2})-(\d{2})-(\d{4})')
+_MONTHS = {
+    name: number
+    for number, names in enumerate((
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"),
+        ("may",), ("june", "jun"), ("july", "jul"), ("august", "aug"),
+        ("september", "sep"), ("october", "oct"), ("november", "nov"), ("december", "dec"),
+    ), start=1)
+    for name in names
+}
 
-class MetadataExtractionService:
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-2.5-flash') 
-        self.extraction_prompt = self._build_extraction_prompt()
-    
-    def _normalize_date(self, date_string: str) -> str:
-        """
-        Normalize date string to DD-MM-YYYY format
-        """
-        if not date_string or date_string.strip().lower() in ['na', '', 'n/a']:
-            return "NA"
-        
-        date_string = date_string.strip()
-        
-        # Common date patterns to try
-        date_patterns = [
-            "%Y-%m-%d",      # 2024-12-31
-            "%d-%m-%Y",      # 31-12-2024
-            "%m-%d-%Y",      # 12-31-2024
-            "%d/%m/%Y",      # 31/12/2024
-            "%m/%d/%Y",      # 12/31/2024
-            "%Y/%m/%d",      # 2024/12/31
-            "%d.%m.%Y",      # 31.12.2024
-            "%Y.%m.%d",      # 2024.12.31
-            "%B %d, %Y",     # December 31, 2024
-            "%b %d, %Y",     # Dec 31, 2024
-            "%d %B %Y",      # 31 December 2024
-            "%d %b %Y",      # 31 Dec 2024
-        ]
-        
-        for pattern in date_patterns:
-            try:
-                parsed_date = datetime.strptime(date_string, pattern)
-                return parsed_date.strftime("%d-%m-%Y")
-            except ValueError:
-                continue
-        
-        # Try to extract date with regex for more flexible parsing
-        # Look for patterns like "31st December 2024", "Dec 31, 2024", etc.
-        import re
-        
-        # Remove ordinal suffixes (1st, 2nd, 3rd, 4th, etc.)
-        cleaned_date = re.sub(r'(\d+)(st|nd|rd|th)', r'\1', date_string)
-        
-        for pattern in date_patterns:
-            try:
-                parsed_date = datetime.strptime(cleaned_date, pattern)
-                return parsed_date.strftime("%d-%m-%Y")
-            except ValueError:
-                continue
-        
-        logger.warning(f"Could not parse date format: {date_string}")
-        return date_string  # Return original if parsing fails
-    
-    def _convert_currency_to_usd(self, amount_str: str, currency: str) -> str:
-        """
-        Convert local currency amount to USD
-        """
-        if not amount_str or amount_str.strip().lower() in ['na', '', 'n/a']:
-            return "NA"
-        
-        if not currency or currency.strip().lower() in ['na', '', 'n/a']:
-            return "NA"
-        
-        # Clean the amount string
-        cleaned_amount = re.sub(r'[^\d.,]', '', amount_str.strip())
-        
-        # Handle different number formats
-        if ',' in cleaned_amount and '.' in cleaned_amount:
-            # Assume comma is thousands separator and dot is decimal
-            cleaned_amount = cleaned_amount.replace(',', '')
-        elif ',' in cleaned_amount:
-            # Could be either thousands separator or decimal separator
-            # If more than 3 digits after comma, it's likely decimal
-            parts = cleaned_amount.split(',')
-            if len(parts) == 2 and len(parts[1]) <= 3:
-                # Likely thousands separator
-                cleaned_amount = cleaned_amount.replace(',', '')
-            else:
-                # Likely decimal separator
-                cleaned_amount = cleaned_amount.replace(',', '.')
-        
-        try:
-            amount = float(cleaned_amount)
-        except ValueError:
-            logger.warning(f"Could not parse amount: {amount_str}")
-            return "NA"
-        
-        # If already in USD, return as is
-        if currency.upper() in ['USD', 'US$', '$']:
-            return f"{amount:.2f}"
-        
-        # Simple exchange rates (in production, use a real API like Fixer.io or CurrencyAPI)
-        # These are approximate rates as of 2024
-        exchange_rates = {
-            'EUR': 1.08,    # 1 EUR = 1.08 USD
-            'GBP': 1.26,    # 1 GBP = 1.26 USD
-            'INR': 0.012,   # 1 INR = 0.012 USD
-            'JPY': 0.0067,  # 1 JPY = 0.0067 USD
-            'CAD': 0.74,    # 1 CAD = 0.74 USD
-            'AUD': 0.66,    # 1 AUD = 0.66 USD
-            'CHF': 1.10,    # 1 CHF = 1.10 USD
-            'CNY': 0.14,    # 1 CNY = 0.14 USD
-            'SGD': 0.74,    # 1 SGD = 0.74 USD
-        }
-        
-        # Try to get exchange rate
-        rate = exchange_rates.get(currency.upper())
-        if rate:
-            usd_amount = amount * rate
-            return f"{usd_amount:.2f}"
-        
-        # If currency not found, try to get from a free API (optional)
-        try:
-            # Using a simple exchange rate API (you might want to use a more reliable one)
-            response = requests.get(f"https://api.exchangerate-api.com/v4/latest/{currency.upper()}", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                usd_rate = data.get('rates', {}).get('USD')
-                if usd_rate:
-                    usd_amount = amount * usd_rate
-                    return f"{usd_amount:.2f}"
-        except Exception as e:
-            logger.warning(f"Could not fetch exchange rate for {currency}: {str(e)}")
-        
-        logger.warning(f"No exchange rate found for currency: {currency}")
-        return "NA"
-    
-    def _calculate_contract_status_and_tag(self, start_date: str, end_date: str, metadata: Dict) -> tuple:
-        """
-        Calculate contract status and tag based on dates and content
-        """
-        current_date = datetime.now()
-        
-        # Check if it's a draft based on missing signatures/stakeholders
-        vendor_name = metadata.get('vendor_name', 'NA').strip()
-        if vendor_name in ['NA', '', 'n/a'] or len(vendor_name) < 3:
-            return "Draft", "NA"
-        
-        # Try to parse dates
-        try:
-            if start_date and start_date not in ['NA', '', 'n/a']:
-                start_dt = datetime.strptime(start_date, "%d-%m-%Y")
-            else:
-                start_dt = None
-                
-            if end_date and end_date not in ['NA', '', 'n/a']:
-                end_dt = datetime.strptime(end_date, "%d-%m-%Y")
-            else:
-                end_dt = None
-        except ValueError:
-            # If date parsing fails, default to Draft
-            return "Draft", "NA"
-        
-        # Determine status based on dates
-        if start_dt is None and end_dt is None:
-            status = "Draft"
-        elif start_dt is None:
-            status = "Draft"
-        elif end_dt is None:
-            status = "Active"  # No end date means ongoing
-        elif end_dt < current_date:
-            status = "Expired"
-        elif start_dt <= current_date <= end_dt:
-            status = "Active"
-        else:
-            status = "Draft"  # Future contract
-        
-        # Calculate contract tag
-        tag = "NA"
-        if status == "Active" and end_dt:
-            days_to_expiry = (end_dt - current_date).days
-            if days_to_expiry < 30:
-                tag = "Expiry < 30 days"
-            elif 30 <= days_to_expiry <= 90:
-                tag = "Expiry 30 to 90 days"
-            elif days_to_expiry > 90:
-                tag = "Expiry > 90 days"
-        
-        return status, tag
-    
-    def _build_extraction_prompt(self) -> str:
-        """
-        Build the prompt for metadata extraction
-        """
-        return """
+def _format_date(year: int, month: Optional[int], day: int) -> Optional[str]:
+    """Format as DD-MM-YYYY, or None if the parts don't form a real date"""
+    if not month or not 1 <= month <= 12 or year < 1 or not 1 <= day <= calendar.monthrange(year, month)[1]:
+        return None
+    return f"{day:02d}-{month:02d}-{year:04d}"
+
+class _NumericCharTable(dict):
+    """
+    str.translate table that keeps decimal digits, '.' and ',' and deletes everything else.
+    Entries are filled in on first sight of each character, so any script's digits work.
+    """
+    def __missing__(self, code: int) -> Optional[int]:
+        char = chr(code)
+        self[code] = keep = code if char.isdecimal() or char in ".," else None
+        return keep
+
+_NUMERIC_CHARS = _NumericCharTable()
+
+# Placeholder values treated as "not provided" (lowercased / as returned after cleaning)
+_NA_VALUES = frozenset({"na", "", "n/a"})
+_MISSING_VALUES = frozenset({"NA", "", "n/a"})
+_NA_CURRENCIES = frozenset({"NA", "", "N/A"})
+_USD_CODES = frozenset({"USD", "US$", "$"})
+
+# Expiry tag buckets for active contracts: < 30 days, 30-90 days, > 90 days
+_EXPIRY_TAG_BOUNDS = (30, 91)
+_EXPIRY_TAGS = ("Expiry < 30 days", "Expiry 30 to 90 days", "Expiry > 90 days")
+
+# Exchange rates (1 unit = X USD), seeded with approximate 2024 rates and refreshed
+# from exchangerate-api.com at most once per TTL for every currency at once
+EXCHANGE_RATE_URL = "https://api.exchangerate-api.com/v4/latest/USD"
+EXCHANGE_RATE_TTL = timedelta(hours=24)
+EXCHANGE_RATE_RETRY_INTERVAL = timedelta(minutes=5)
+_exchange_rates: Dict[str, float] = {
+    'EUR': 1.08,    # 1 EUR = 1.08 USD
+    'GBP': 1.26,    # 1 GBP = 1.26 USD
+    'INR': 0.012,   # 1 INR = 0.012 USD
+    'JPY': 0.0067,  # 1 JPY = 0.0067 USD
+    'CAD': 0.74,    # 1 CAD = 0.74 USD
+    'AUD': 0.66,    # 1 AUD = 0.66 USD
+    'CHF': 1.10,    # 1 CHF = 1.10 USD
+    'CNY': 0.14,    # 1 CNY = 0.14 USD
+    'SGD': 0.74,    # 1 SGD = 0.74 USD
+}
+_exchange_rates_expire_at: Optional[datetime] = None
+_exchange_rates_lock = asyncio.Lock()
+
+# Shared HTTP client so exchange-rate refreshes reuse a warm connection
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Retry policy for Gemini calls - full-jitter backoff, transient errors only
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# In-flight Gemini calls per service instance, across every caller
+GEMINI_MAX_CONCURRENCY = 8
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+# Google Generative AI is configured on first model construction
+_genai_configured = False
+
+# Models and tokenizer are shared by every service instance
+_models: Dict[str, genai.GenerativeModel] = {}
+_tokenizer = None
+
+# Response schema mirroring the JSON format requested in the extraction prompt
+_TEXT_FIELDS = [
+    "vendor_name", "start_date", "end_date", "contract_duration",
+    "contract_value_local", "currency", "contract_value_usd", "contract_status",
+    "contract_type", "scope_of_services", "auto_renewal", "payment_terms",
+    "liability_cap", "termination_for_convenience", "price_escalation",
+]
+_RISK_SCORE_FIELDS = [
+    "auto_renewal_risk_score", "payment_terms_risk_score", "liability_cap_risk_score",
+    "termination_convenience_risk_score", "price_escalation_risk_score",
+]
+
+CONTRACT_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{field: {"type": "string"} for field in _TEXT_FIELDS},
+        **{field: {"type": "integer"} for field in _RISK_SCORE_FIELDS},
+        "overall_risk_score": {"type": "number"},
+    },
+    "required": _TEXT_FIELDS + _RISK_SCORE_FIELDS + ["overall_risk_score"],
+}
+
+# Extraction is deterministic - no sampling, bounded output, JSON only
+GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0,
+    top_p=1,
+    max_output_tokens=1024,
+    response_mime_type="application/json",
+    response_schema=CONTRACT_METADATA_SCHEMA,
+)
+
+# Thinking models (2.5 and later) count their thinking tokens against max_output_tokens, so a
+# 1024 cap can leave no room for the JSON on long contracts - they get the model's own limit
+THINKING_MODEL_PREFIXES = ("gemini-2.5", "gemini-3")
+THINKING_GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0,
+    top_p=1,
+    response_mime_type="application/json",
+    response_schema=CONTRACT_METADATA_SCHEMA,
+)
+
+# Token budget for a single contract. Long contracts keep their opening pages plus the
+# closing pages (signatures, end dates) rather than a pure prefix.
+MAX_CONTRACT_TOKENS = 8000
+CONTRACT_HEAD_RATIO = 0.75
+
+# Parsed responses kept in memory, keyed by prompt hash (LRU)
+RESPONSE_CACHE_SIZE = 512
+
+# Normalized date strings memoized by _normalize_date
+DATE_CACHE_SIZE = 2048
+
+# Fixed prompt prefix; the contract text is appended to it
+EXTRACTION_PROMPT = """
 
 You are an expert Contract Manager and Legal Analyst. You carefully read IT service contracts and extract only the precise, objective details requested. Do not add assumptions. If information is missing or ambiguous, return "NA".
 
@@ -314,25 +294,416 @@ Please return the response in the following JSON format:
 
 Contract text to analyze:
 """
+
+def _get_model(model_name: str) -> genai.GenerativeModel:
+    """Get or create the shared GenerativeModel for model_name"""
+    global _genai_configured
+    if not _genai_configured:
+        genai.configure(api_key=settings.google_api_key)
+        _genai_configured = True
+    
+    if model_name not in _models:
+        _models[model_name] = genai.GenerativeModel(model_name, generation_config=_generation_config(model_name))
+    return _models[model_name]
+
+def _generation_config(model_name: str) -> genai.GenerationConfig:
+    """Default generation config for model_name"""
+    if model_name.removeprefix("models/").startswith(THINKING_MODEL_PREFIXES):
+        return THINKING_GENERATION_CONFIG
+    return GENERATION_CONFIG
+
+def _read_exchange_rate_cache() -> Optional[Dict]:
+    """Read the rates file persisted by a previous run, or None if it's missing or unreadable"""
+    try:
+        with open(settings.exchange_rate_cache_path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _write_exchange_rate_cache(rates: Dict[str, float]):
+    """Persist fetched rates for the next restart (written to a temp file, then renamed into place)"""
+    cache_path = settings.exchange_rate_cache_path
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(orjson.dumps({"fetched_at": datetime.now().isoformat(), "rates": rates}))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not persist exchange rates: {str(e)}")
+
+async def _load_cached_exchange_rates() -> Optional[datetime]:
+    """Load rates persisted by a previous run, returning when they were fetched"""
+    cached = await asyncio.to_thread(_read_exchange_rate_cache)
+    try:
+        fetched_at = datetime.fromisoformat(cached["fetched_at"])
+        _exchange_rates.update(cached["rates"])
+        return fetched_at
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Get or create the shared HTTP client"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=5.0)
+    return _http_client
+
+async def close_http_client():
+    """Close the shared HTTP client (called on application shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def _fetch_exchange_rates():
+    """Fetch every USD rate in one request and persist them for the next restart"""
+    response = await _get_http_client().get(EXCHANGE_RATE_URL)
+    response.raise_for_status()
+    
+    # The API quotes units per USD; store USD per unit
+    rates = {code: 1 / rate for code, rate in response.json().get("rates", {}).items() if rate}
+    _exchange_rates.update(rates)
+    await asyncio.to_thread(_write_exchange_rate_cache, rates)
+
+async def _get_usd_rate(currency: str) -> Optional[float]:
+    """
+    Get the USD value of one unit of currency, refreshing the shared rate table when it
+    has never been loaded or the fetched rates are older than EXCHANGE_RATE_TTL. The seeded
+    rates are only used while fetching fails, so every currency converts with the same table.
+    """
+    global _exchange_rates_expire_at
+    
+    def _needs_refresh() -> bool:
+        return _exchange_rates_expire_at is None or datetime.now() >= _exchange_rates_expire_at
+    
+    if _needs_refresh():
+        async with _exchange_rates_lock:
+            # Another extraction may have refreshed the rates while we waited
+            if _needs_refresh():
+                if _exchange_rates_expire_at is None:
+                    fetched_at = await _load_cached_exchange_rates()
+                    if fetched_at is not None:
+                        _exchange_rates_expire_at = fetched_at + EXCHANGE_RATE_TTL
+                
+                if _needs_refresh():
+                    try:
+                        await _fetch_exchange_rates()
+                        _exchange_rates_expire_at = datetime.now() + EXCHANGE_RATE_TTL
+                    except Exception as e:
+                        logger.warning(f"Could not fetch exchange rates: {str(e)}")
+                        _exchange_rates_expire_at = datetime.now() + EXCHANGE_RATE_RETRY_INTERVAL
+    
+    return _exchange_rates.get(currency)
+
+def _get_tokenizer():
+    """Get or create the shared tiktoken encoding"""
+    global _tokenizer
+    if _tokenizer is None:
+        # Local approximation of Gemini's tokenizer for truncation
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+class _JsonObjectTracker:
+    """
+    Tracks brace depth across streamed chunks to detect when the first JSON object closes
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, text: str) -> int:
+        """
+        Consume a chunk, returning the index of the closing brace of the first
+        top-level object or -1 if it hasn't closed yet
+        """
+        for index, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                # Ignore anything (e.g. markdown fences) before the object starts
+                if char == "{":
+                    self.depth = 1
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return index
+        return -1
+
+def _parse_ddmmyyyy(date_string: str) -> datetime:
+    """
+    Parse a DD-MM-YYYY date as produced by _normalize_date without going through strptime.
+    Anything that isn't exactly that shape falls back to strptime, so it is accepted or
+    rejected exactly as before.
+    """
+    match = _DDMMYYYY_RE.fullmatch(date_string)
+    if match is None:
+        return datetime.strptime(date_string, "%d-%m-%Y")
+    day, month, year = match.groups()
+    return datetime(int(year), int(month), int(day))
+
+async def _cancel_stream(stream: Any) -> None:
+    """
+    End a streamed response we stopped reading early. Closing our iterator over the response
+    leaves the SDK's own iterator - and with it the request - open, so close that too.
+    That iterator is the private _iterator attribute of google-generativeai's async response;
+    on SDK versions without it this does nothing and the request ends when it is collected.
+    """
+    iterator = getattr(stream, "_iterator", None)
+    if hasattr(iterator, "cancel"):
+        iterator.cancel()
+    elif hasattr(iterator, "aclose"):
+        await iterator.aclose()
+
+def _enum_name(value: Any) -> Optional[str]:
+    """Name of an SDK enum value (finish / block reason), or None when unset"""
+    if not value:
+        return None
+    return getattr(value, "name", str(value))
+
+def _loads_json(text: str) -> Any:
+    """
+    Parse model output with orjson, falling back to the stdlib parser for the few inputs
+    orjson rejects but json accepts (NaN / Infinity literals, integers beyond 64 bits)
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+def _find_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced {...} substring of text, or None. Linear scan that
+    respects strings and escapes, so braces inside values don't end the object early.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = _JsonObjectTracker().feed(text[start:])
+    return text[start:start + end + 1] if end >= 0 else None
+
+class MetadataExtractionService:
+    # Template for _get_default_metadata, built once
+    _DEFAULT_METADATA = {
+        "contract_name": "NA",
+        "start_date": "NA",
+        "end_date": "NA",
+        "vendor_name": "NA",
+        "contract_duration": "NA",
+        "contract_value_local": "NA",
+        "currency": "NA",
+        "contract_value_usd": "NA",
+        "contract_status": "NA",
+        "contract_type": "Other",
+        "scope_of_services": "Other",
+        "contract_tag": "No expiry date",
+        "contract_value": "NA",
+        "auto_renewal": "NA",
+        "payment_terms": "NA",
+        "liability_cap": "NA",
+        "termination_for_convenience": "NA",
+        "price_escalation": "NA"
+    }
+    
+    def __init__(self):
+        self.extraction_prompt = EXTRACTION_PROMPT
+        # Hash state of the fixed prompt prefix, so cache keys only hash the contract text
+        self._prompt_hash = hashlib.sha256(self.extraction_prompt.encode())
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._request_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    
+    # Models and tokenizer are resolved on first use: the fallback model is only needed on
+    # retries and short ASCII contracts never touch the tokenizer
+    @cached_property
+    def model(self) -> genai.GenerativeModel:
+        return _get_model(settings.gemini_model)
+    
+    @cached_property
+    def fallback_model(self) -> genai.GenerativeModel:
+        return _get_model(settings.gemini_fallback_model)
+    
+    @cached_property
+    def tokenizer(self):
+        return _get_tokenizer()
+    
+    @staticmethod
+    @lru_cache(maxsize=DATE_CACHE_SIZE)
+    def _normalize_date(date_string: str) -> str:
+        """
+        Normalize date string to DD-MM-YYYY format.
+        Pure function of its input, so repeated dates are served from the LRU cache.
+        """
+        # Strip once and reuse for the NA check and all parsing below
+        date_string = (date_string or "").strip()
+        if date_string.lower() in _NA_VALUES:
+            return "NA"
+        
+        match = _DATE_RE.match(date_string)
+        if match:
+            parts = match.groupdict()
+            if parts["num_y"]:
+                year, first, second = int(parts["num_y"]), int(parts["num_a"]), int(parts["num_b"])
+                # Day-first wins when both readings are valid; dotted dates are always day-first
+                normalized = _format_date(year, second, first)
+                if normalized is None and parts["num_sep"] != ".":
+                    normalized = _format_date(year, first, second)
+            elif parts["ymd_y"]:
+                normalized = _format_date(int(parts["ymd_y"]), int(parts["ymd_m"]), int(parts["ymd_d"]))
+            elif parts["mdy_y"]:
+                normalized = _format_date(
+                    int(parts["mdy_y"]), _MONTHS.get(parts["mdy_month"].lower()), int(parts["mdy_d"])
+                )
+            else:
+                normalized = _format_date(
+                    int(parts["dmy_y"]), _MONTHS.get(parts["dmy_month"].lower()), int(parts["dmy_d"])
+                )
+            
+            if normalized is not None:
+                return normalized
+        
+        logger.warning(f"Could not parse date format: {date_string}")
+        return date_string  # Return original if parsing fails
+    
+    async def _convert_currency_to_usd(self, amount_str: str, currency: str) -> str:
+        """
+        Convert local currency amount to USD
+        """
+        # Strip (and upper-case the currency) once and reuse for the NA checks and lookups below
+        amount_str = (amount_str or "").strip()
+        currency = (currency or "").strip().upper()
+        if amount_str.lower() in _NA_VALUES or currency in _NA_CURRENCIES:
+            return "NA"
+        
+        # Clean the amount string
+        cleaned_amount = amount_str.translate(_NUMERIC_CHARS)
+        
+        # Handle different number formats
+        if ',' in cleaned_amount and '.' in cleaned_amount:
+            # Assume comma is thousands separator and dot is decimal
+            cleaned_amount = cleaned_amount.replace(',', '')
+        elif ',' in cleaned_amount:
+            # Could be either thousands separator or decimal separator
+            # If more than 3 digits after comma, it's likely decimal
+            parts = cleaned_amount.split(',')
+            if len(parts) == 2 and len(parts[1]) <= 3:
+                # Likely thousands separator
+                cleaned_amount = cleaned_amount.replace(',', '')
+            else:
+                # Likely decimal separator
+                cleaned_amount = cleaned_amount.replace(',', '.')
+        
+        try:
+            amount = float(cleaned_amount)
+        except ValueError:
+            logger.warning(f"Could not parse amount: {amount_str}")
+            return "NA"
+        
+        # If already in USD, return as is
+        if currency in _USD_CODES:
+            return f"{amount:.2f}"
+        
+        # Look up the shared rate table (fetched at most once per TTL)
+        rate = await _get_usd_rate(currency)
+        if rate:
+            usd_amount = amount * rate
+            return f"{usd_amount:.2f}"
+        
+        logger.warning(f"No exchange rate found for currency: {currency}")
+        return "NA"
+    
+    def _calculate_contract_status_and_tag(self, start_date: str, end_date: str, metadata: Dict) -> tuple:
+        """
+        Calculate contract status and tag based on dates and content
+        """
+        current_date = datetime.now()
+        
+        # Check if it's a draft based on missing signatures/stakeholders
+        vendor_name = metadata.get('vendor_name', 'NA').strip()
+        if vendor_name in _MISSING_VALUES or len(vendor_name) < 3:
+            return "Draft", "NA"
+        
+        # Try to parse dates
+        try:
+            if start_date and start_date not in _MISSING_VALUES:
+                start_dt = _parse_ddmmyyyy(start_date)
+            else:
+                start_dt = None
+                
+            if end_date and end_date not in _MISSING_VALUES:
+                end_dt = _parse_ddmmyyyy(end_date)
+            else:
+                end_dt = None
+        except ValueError:
+            # If date parsing fails, default to Draft
+            return "Draft", "NA"
+        
+        # Determine status based on dates
+        if start_dt is None and end_dt is None:
+            status = "Draft"
+        elif start_dt is None:
+            status = "Draft"
+        elif end_dt is None:
+            status = "Active"  # No end date means ongoing
+        elif end_dt < current_date:
+            status = "Expired"
+        elif start_dt <= current_date <= end_dt:
+            status = "Active"
+        else:
+            status = "Draft"  # Future contract
+        
+        # Calculate contract tag
+        tag = "NA"
+        if status == "Active" and end_dt:
+            days_to_expiry = (end_dt - current_date).days
+            tag = _EXPIRY_TAGS[bisect.bisect_right(_EXPIRY_TAG_BOUNDS, days_to_expiry)]
+        
+        return status, tag
     
     async def extract_metadata(self, contract_text: str, file_id: str) -> Dict:
         """
-        Extract metadata from contract text using Google's Gemini model
+        Extract metadata from contract text using Google's Gemini model.
+        Only depends on the extracted text, so it never blocks the event loop and can be
+        awaited with asyncio.gather alongside other independent stages (e.g. vector processing).
         """
         try:
             logger.info(f"Starting metadata extraction for file {file_id}")
             
             # Prepare the full prompt
-            full_prompt = self.extraction_prompt + contract_text[:10000]  # Limit text to avoid token limits
+            contract_text = await self._truncate_contract_text(contract_text)
+            full_prompt = self.extraction_prompt + contract_text
             
-            # Generate response from Gemini
-            response = await self._generate_with_retry(full_prompt)
+            # Identical prompts (re-uploads, retries, duplicates) reuse the parsed response.
+            # Only the raw response is cached - status/tag depend on today's date.
+            prompt_hash = self._prompt_hash.copy()
+            prompt_hash.update(contract_text.encode())
+            cache_key = prompt_hash.hexdigest()
+            metadata = self._cache.get(cache_key)
             
-            # Parse the JSON response
-            metadata = self._parse_response(response.text)
+            if metadata is not None:
+                self._cache.move_to_end(cache_key)
+                logger.info(f"Using cached extraction response for file {file_id}")
+            else:
+                # Generate response from Gemini
+                response = await self._generate_with_retry(full_prompt)
+                
+                # Parse the JSON response
+                metadata = self._parse_response(response.text)
+                self._cache_response(cache_key, metadata)
             
             # Validate and clean the metadata
-            cleaned_metadata = self._validate_and_clean_metadata(metadata)
+            cleaned_metadata = await self._validate_and_clean_metadata(metadata)
             
             logger.info(f"Successfully extracted metadata for file {file_id}")
             return cleaned_metadata
@@ -341,92 +712,198 @@ Contract text to analyze:
             logger.error(f"Error extracting metadata for file {file_id}: {str(e)}")
             raise Exception(f"Failed to extract metadata: {str(e)}")
     
+    async def _truncate_contract_text(self, contract_text: str) -> str:
+        """
+        Fit contract text into MAX_CONTRACT_TOKENS, keeping the head and tail of long contracts
+        """
+        # Every cl100k token spans at least one byte, so short ASCII text can't exceed the
+        # budget - skip tokenizing it (str.isascii is a flag check, not a scan)
+        if len(contract_text) <= MAX_CONTRACT_TOKENS and contract_text.isascii():
+            return contract_text
+        
+        # Tokenizing a long contract takes a while, so keep it off the event loop
+        return await asyncio.to_thread(self._truncate_tokens, contract_text)
+    
+    def _truncate_tokens(self, contract_text: str) -> str:
+        """Tokenize the contract and cut it down to MAX_CONTRACT_TOKENS if it's longer"""
+        tokens = self.tokenizer.encode(contract_text, disallowed_special=())
+        if len(tokens) <= MAX_CONTRACT_TOKENS:
+            return contract_text
+        
+        head = int(MAX_CONTRACT_TOKENS * CONTRACT_HEAD_RATIO)
+        tail = MAX_CONTRACT_TOKENS - head
+        logger.info(f"Truncating contract text from {len(tokens)} to {MAX_CONTRACT_TOKENS} tokens")
+        return self.tokenizer.decode(tokens[:head]) + "\n...\n" + self.tokenizer.decode(tokens[-tail:])
+    
+    def _cache_response(self, cache_key: str, metadata: Dict):
+        """
+        Remember a successfully parsed response, evicting the least recently used entry
+        """
+        if not isinstance(metadata, dict) or metadata == self._DEFAULT_METADATA:
+            return  # Don't cache parse failures
+        self._cache[cache_key] = metadata
+        if len(self._cache) > RESPONSE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
     async def _generate_with_retry(self, prompt: str, max_retries: int = 3) -> Any:
         """
-        Generate response with retry logic
+        Generate response with retry logic, escalating to the fallback model after the first failure.
+        Only transient errors (rate limits, timeouts, 5xx) are retried.
         """
         for attempt in range(max_retries):
             try:
-                response = self.model.generate_content(prompt)
+                model = self.model if attempt == 0 else self.fallback_model
+                # Slot is held for the call only, never across the retry sleep
+                async with self._request_semaphore:
+                    response = await self._stream_json_response(model, prompt)
                 return response
-            except Exception as e:
+            except TRANSIENT_ERRORS as e:
                 if attempt == max_retries - 1:
                     raise e
-                logger.warning(f"Retry {attempt + 1}/{max_retries} for metadata generation: {str(e)}")
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                # Prefer the server's retry hint, else full jitter to avoid synchronized retries
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                logger.warning(f"Retry {attempt + 1}/{max_retries} for metadata generation in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+    
+    def _retry_after(self, error: Exception) -> Optional[float]:
+        """
+        Server-suggested retry delay in seconds, from a Retry-After header or RetryInfo detail
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers and headers.get("Retry-After"):
+            try:
+                return min(float(headers["Retry-After"]), RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+        
+        for detail in getattr(error, "details", None) or []:
+            retry_delay = getattr(detail, "retry_delay", None)
+            if retry_delay is None:
+                continue
+            if isinstance(retry_delay, timedelta):
+                seconds = retry_delay.total_seconds()
+            else:
+                seconds = retry_delay.seconds + retry_delay.nanos / 1e9
+            return min(seconds, RETRY_MAX_DELAY)
+        return None
+    
+    async def _stream_json_response(self, model: genai.GenerativeModel, prompt: str) -> SimpleNamespace:
+        """
+        Stream the response and stop reading as soon as the first JSON object is complete,
+        skipping any trailing explanation the model emits after it
+        """
+        if not hasattr(model, "generate_content_async"):
+            # Older SDK releases have no async API - keep the blocking call off the event loop
+            response = await asyncio.to_thread(model.generate_content, prompt)
+            return SimpleNamespace(text=response.text)
+        
+        stream = await model.generate_content_async(prompt, stream=True)
+        tracker = _JsonObjectTracker()
+        parts = []
+        
+        chunks = stream.__aiter__()
+        exhausted = False
+        block_reason = None
+        finish_reason = None
+        try:
+            async for chunk in chunks:
+                candidates = chunk.candidates
+                if not candidates:
+                    # Blocked prompt - there's nothing to read, only the block reason
+                    block_reason = _enum_name(getattr(chunk.prompt_feedback, "block_reason", None))
+                    continue
+                candidate = candidates[0]
+                if candidate.finish_reason:
+                    finish_reason = _enum_name(candidate.finish_reason)
+                    # The closing chunk carries only the finish reason, and .text raises on it
+                    if not candidate.content.parts:
+                        continue
+                chunk_text = chunk.text
+                end = tracker.feed(chunk_text)
+                if end >= 0:
+                    parts.append(chunk_text[:end + 1])
+                    break
+                parts.append(chunk_text)
+            else:
+                exhausted = True
+        finally:
+            await chunks.aclose()
+            if not exhausted:
+                await _cancel_stream(stream)
+        
+        # An empty, blocked or cut-off response must fail the file rather than parse as all-"NA"
+        # metadata. Stopping early at the end of the object means the finish reason never arrived.
+        # Blocks and non-STOP finishes are deterministic, so they're raised as permanent errors
+        if not parts or (exhausted and finish_reason != "STOP"):
+            if block_reason:
+                raise ProcessingException(
+                    f"Gemini blocked the prompt (block reason: {block_reason})",
+                    error_type="response_blocked"
+                )
+            if finish_reason:
+                raise ProcessingException(
+                    f"Gemini returned no usable response (finish reason: {finish_reason})",
+                    error_type="response_blocked"
+                )
+            raise ValueError("Gemini returned an empty response")
+        
+        # Same shape as the SDK response so _parse_response is unchanged
+        return SimpleNamespace(text="".join(parts))
     
     def _parse_response(self, response_text: str) -> Dict:
         """
         Parse the JSON response from the LLM
         """
         try:
-            # Clean the response text - remove any markdown formatting
-            cleaned_text = response_text.strip()
-            
-            # Remove markdown code blocks if present
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
-            
-            cleaned_text = cleaned_text.strip()
-            
-            # Parse JSON
-            metadata = json.loads(cleaned_text)
+            # JSON mode usually returns clean JSON - parse it as-is before stripping fences
+            try:
+                metadata = _loads_json(response_text)
+            except json.JSONDecodeError:
+                metadata = _loads_json(self._strip_code_fences(response_text))
             return metadata
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {response_text}")
-            # Try to extract JSON using regex
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
+            # Decode the first balanced JSON object in the text (single forward scan)
+            candidate = _find_json_object(response_text)
+            if candidate is not None:
                 try:
-                    return json.loads(json_match.group())
+                    return _loads_json(candidate)
                 except json.JSONDecodeError:
                     pass
             
             # Return default structure if parsing fails
             return self._get_default_metadata()
     
-    def _validate_and_clean_metadata(self, metadata: Dict) -> Dict:
+    def _strip_code_fences(self, response_text: str) -> str:
+        """
+        Remove markdown code block formatting around a JSON response
+        """
+        return _CODE_FENCE_RE.sub("", response_text.strip())
+    
+    async def _validate_and_clean_metadata(self, metadata: Dict) -> Dict:
         """
         Validate and clean the extracted metadata with date normalization and currency conversion
         """
-        # Define valid options
-        valid_contract_types = ["MSA", "SOW", "Amendment", "Agreement", "Order Form", "Change Request", "Other"]
-        valid_scope_types = ["Managed Services", "Time & Material", "Hardware", "Software", "Maintenance", "Other"]
-        valid_contract_status = ["Active", "Draft", "Expired"]
-        valid_contract_tags = [
-            "Expiry < 30 days", 
-            "Expiry 30 to 90 days", 
-            "Expiry > 90 days", 
-            "NA"
-        ]
+        # 1. Coerce into the schema - fills missing fields with "NA", stringifies values
+        #    and falls back to "Other" for unknown contract types / scopes
+        contract = ContractMetadata.model_validate(metadata)
         
-        # Ensure all required fields exist
-        required_fields = [
-            "contract_name", "start_date", "end_date", "vendor_name", "contract_duration",
-            "contract_value_local", "currency", "contract_value_usd",
-            "contract_status", "contract_type", "scope_of_services", "contract_tag",
-            "auto_renewal", "payment_terms", "liability_cap", "termination_for_convenience", "price_escalation"
-        ]
-        for field in required_fields:
-            if field not in metadata or metadata[field] is None:
-                metadata[field] = "NA"
+        # 2. Normalize dates to DD-MM-YYYY format
+        contract.start_date = self._normalize_date(contract.start_date)
+        contract.end_date = self._normalize_date(contract.end_date)
         
-        # 1. Normalize dates to DD-MM-YYYY format
-        metadata["start_date"] = self._normalize_date(str(metadata.get("start_date", "NA")))
-        metadata["end_date"] = self._normalize_date(str(metadata.get("end_date", "NA")))
+        # 3. If LLM didn't provide USD conversion or provided "NA", calculate it ourselves
+        if contract.contract_value_usd == "NA":
+            contract.contract_value_usd = await self._convert_currency_to_usd(
+                contract.contract_value_local, contract.currency
+            )
         
-        # 2. Convert currency to USD if needed
-        local_value = metadata.get("contract_value_local", "NA")
-        currency = metadata.get("currency", "NA")
+        metadata = contract.model_dump()
         
-        # If LLM didn't provide USD conversion or provided "NA", calculate it ourselves
-        if metadata.get("contract_value_usd") in ["NA", "", None]:
-            metadata["contract_value_usd"] = self._convert_currency_to_usd(local_value, currency)
-        
-        # 3. Calculate proper contract status and tag based on dates and business logic
+        # 4. Calculate proper contract status and tag based on dates and business logic
         calculated_status, calculated_tag = self._calculate_contract_status_and_tag(
             metadata["start_date"], 
             metadata["end_date"], 
@@ -437,37 +914,12 @@ Contract text to analyze:
         metadata["contract_status"] = calculated_status
         metadata["contract_tag"] = calculated_tag
         
-        # 4. Validate contract type
-        if metadata.get("contract_type") not in valid_contract_types:
-            metadata["contract_type"] = "Other"
-        
-        # 5. Validate scope of services  
-        if metadata.get("scope_of_services") not in valid_scope_types:
-            metadata["scope_of_services"] = "Other"
+        # 5. Keep legacy contract_value field for backward compatibility
+        metadata["contract_value"] = metadata["contract_value_local"]
         
-        # 6. Clean up empty strings and convert all non-string values to strings
-        for key, value in metadata.items():
-            if value is None:
-                metadata[key] = "NA"
-            elif isinstance(value, str) and value.strip() == "":
-                metadata[key] = "NA"
-            elif not isinstance(value, str):
-                # Convert all non-string values (int, float, etc.) to strings
-                metadata[key] = str(value)
-        
-        # 7. Keep legacy contract_value field for backward compatibility
-        if "contract_value_local" in metadata and metadata["contract_value_local"] != "NA":
-            metadata["contract_value"] = metadata["contract_value_local"]
-        else:
-            metadata["contract_value"] = "NA"
-        
-        # 8. Add contract_name if not provided (use filename or vendor name as fallback)
-        if metadata.get("contract_name", "NA") == "NA":
-            vendor_name = metadata.get("vendor_name", "NA")
-            if vendor_name != "NA":
-                metadata["contract_name"] = f"Contract with {vendor_name}"
-            else:
-                metadata["contract_name"] = "NA"
+        # 6. Add contract_name if not provided (use vendor name as fallback)
+        if metadata["contract_name"] == "NA" and metadata["vendor_name"] != "NA":
+            metadata["contract_name"] = f"Contract with {metadata['vendor_name']}"
         
         logger.info(f"Processed metadata - Status: {metadata['contract_status']}, Tag: {metadata['contract_tag']}, "
                    f"Start: {metadata['start_date']}, End: {metadata['end_date']}, "
@@ -479,25 +931,14 @@ Contract text to analyze:
         """
         Return default metadata structure when extraction fails
         """
-        return {
-            "contract_name": "NA",
-            "start_date": "NA",
-            "end_date": "NA",
-            "vendor_name": "NA",
-            "contract_duration": "NA",
-            "contract_value_local": "NA",
-            "currency": "NA",
-            "contract_value_usd": "NA",
-            "contract_status": "NA",
-            "contract_type": "Other",
-            "scope_of_services": "Other",
-            "contract_tag": "No expiry date",
-            "contract_value": "NA",  
-            "auto_renewal": "NA",
-            "payment_terms": "NA",
-            "liability_cap": "NA",
-            "termination_for_convenience": "NA",
-            "price_escalation": "NA"
-        }
+        return dict(self._DEFAULT_METADATA)
     
-metadata_extraction_service = MetadataExtractionService()
+# Global instance
+_metadata_extraction_service = None
+
+def get_metadata_extraction_service() -> MetadataExtractionService:
+    """Get or create metadata extraction service instance"""
+    global _metadata_extraction_service
+    if _metadata_extraction_service is None:
+        _metadata_extraction_service = MetadataExtractionService()
+    return _metadata_extraction_service
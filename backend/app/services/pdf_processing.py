@@ -1,93 +1,274 @@
 import asyncio
-from llama_parse import LlamaParse, ResultType
+from aiolimiter import AsyncLimiter
+from concurrent.futures import ThreadPoolExecutor
 from app.config import settings
+from app.services.llama_parse_jobs import LlamaParseJobTracker
 import logging
-import tempfile
+import aiofiles
+import aiofiles.tempfile
+import hashlib
+import random
+import time
 import os
-from typing import Optional
+import tempfile
+import orjson
+from pypdf import PdfReader, PdfWriter
+from operator import attrgetter
+from typing import Any, Callable, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# Cached parse results older than this are re-parsed, and deleted by the next prune
+PARSE_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+PARSE_CACHE_PRUNE_INTERVAL_SECONDS = 24 * 60 * 60
+
+# LlamaParse upload options. Scanned / image-heavy PDFs get OCR plus auto mode (premium
+# parsing for pages with images); PDFs with real text on every page skip OCR, auto mode
+# and image extraction, which is several times faster.
+ACCURATE_PARSE_OPTIONS = {
+    "language": "en",
+    "disable_ocr": False,
+    "auto_mode": True,
+    "auto_mode_trigger_on_image_in_page": True,
+}
+FAST_PARSE_OPTIONS = {
+    "language": "en",
+    "disable_ocr": True,
+    "auto_mode": False,
+    "disable_image_extraction": True,
+}
+
+# Characters every page's embedded text layer needs for the PDF to skip LlamaParse entirely
+TEXT_LAYER_MIN_PAGE_CHARS = 100
+# Characters every page needs for fast (no OCR) LlamaParse mode. Scanned pages often carry a
+# thin text layer - a stamped page or Bates number, a running header - and still need OCR.
+FAST_PARSE_MIN_PAGE_CHARS = 50
+
+# PDFs longer than this are split locally into files of PAGE_RANGE_SIZE pages, parsed as
+# concurrent LlamaParse jobs - at most PAGE_RANGE_CONCURRENCY per PDF at a time
+LARGE_PDF_PAGES = 200
+PAGE_RANGE_SIZE = 50
+PAGE_RANGE_CONCURRENCY = 4
+
+# LlamaParse retry backoff: exponential with up to 50% jitter so workers don't retry in lockstep
+PARSE_RETRY_BASE_DELAY = 1.0
+PARSE_RETRY_MAX_DELAY = 30.0
+
+def _document_text_getter(doc: Any) -> Callable[[Any], Optional[str]]:
+    """Return a function reading text from parser documents shaped like this one"""
+    if isinstance(doc, str):
+        return lambda d: d if d.strip() else None
+    if isinstance(doc, dict):
+        return lambda d: d.get("text")
+    if hasattr(doc, "text"):
+        return attrgetter("text")
+    if hasattr(doc, "get_content"):
+        return lambda d: d.get_content()
+    if hasattr(doc, "page_content"):
+        return attrgetter("page_content")
+    # Fallback - try to convert to string
+    return lambda d: None if d is None else str(d)
+
+def _is_retryable(error: Exception) -> bool:
+    """Client errors other than timeouts / rate limits (bad request, auth) won't succeed on retry"""
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (408, 429))
+
 class PDFProcessingService:
     def __init__(self):
-        # self.parser = LlamaParse(
-        #     api_key=settings.llama_cloud_api_key,
-        #     result_type=ResultType.TXT,  # Use proper enum value
-        #     verbose=True,
-        #     language="en"
-        # )
-        # self.parser = LlamaParse(
-        #     api_key=settings.llama_cloud_api_key,
-        #     result_type=ResultType.MD,
-        #     disable_ocr=False,
-        #     auto_mode=True,
-        #     auto_mode_trigger_on_image_in_page=True,
-        #     verbose=True,
-        #     language="en"
-        # )
-        pass
+        # One job tracker shared by every file: uploads return as soon as LlamaParse accepts
+        # the job, and a single poller resolves all in-flight jobs
+        self.parser = LlamaParseJobTracker(
+            api_key=settings.llama_cloud_api_key,
+            base_url=settings.llama_cloud_base_url,
+            parse_options=ACCURATE_PARSE_OPTIONS,
+        )
+        # Shared token bucket for job submissions, so a burst of uploads (or page-range
+        # splits) stays under the LlamaParse rate limit instead of retrying on 429s
+        self._limiter = AsyncLimiter(settings.llamaparse_rpm, 60)
+        # Dedicated pool for pypdf text extraction, hashing and cache I/O, so a huge PDF
+        # can't tie up the default executor other libraries rely on
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.max_concurrent_processes,
+            thread_name_prefix="pdf-processing"
+        )
+        # When expired parse cache entries were last pruned (monotonic), None before the first prune
+        self._last_cache_prune: Optional[float] = None
+    
+    async def _run_blocking(self, func, *args):
+        """Run a blocking helper on the service's thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def write_temp_pdf(self, file_content: bytes) -> str:
+        """
+        Write PDF bytes to a temporary file and return its path. The caller removes it
+        with remove_temp_pdf once every stage that needs the file is done.
+        """
+        async with aiofiles.tempfile.NamedTemporaryFile("wb", delete=False, suffix=".pdf") as temp_file:
+            await temp_file.write(file_content)
+            return temp_file.name
+    
+    def remove_temp_pdf(self, temp_file_path: Optional[str]):
+        """Delete a temporary file created by write_temp_pdf"""
+        if not temp_file_path:
+            return
+        try:
+            os.unlink(temp_file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as cleanup_error:
+            logger.warning(f"Failed to cleanup temp file: {cleanup_error}")
     
     async def extract_text_from_pdf(self, file_content: bytes, filename: str) -> str:
         """
-        Extract text from PDF using LlamaParse with proper error handling
+        Extract text from in-memory PDF bytes (spooled to a temporary file for LlamaParse)
         """
-        temp_file_path = None
+        if not file_content:
+            error_msg = "Failed to extract text from PDF: Empty file content provided"
+            logger.error(f"Error extracting text from {filename}: {error_msg}")
+            raise Exception(error_msg)
+        
+        temp_file_path = await self.write_temp_pdf(file_content)
         try:
-            # Validate input
-            if not file_content:
-                raise Exception("Empty file content provided")
-            
-            # Create temporary file for PDF processing
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            # Verify file was written correctly
-            if not os.path.exists(temp_file_path):
-                raise Exception("Temporary file was not created successfully")
+            return await self.extract_text_from_file(temp_file_path, filename)
+        finally:
+            self.remove_temp_pdf(temp_file_path)
+    
+    def _content_key(self, file_path: str) -> str:
+        """Hash of the file's bytes, used as the parse cache key"""
+        with open(file_path, "rb") as f:
+            return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+    
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(settings.parse_cache_directory, f"{key}.json")
+    
+    def _read_cached_text(self, key: str) -> Optional[str]:
+        """Return previously extracted text for this content, if cached and fresh"""
+        cache_path = self._cache_path(key)
+        try:
+            if time.time() - os.path.getmtime(cache_path) > PARSE_CACHE_TTL_SECONDS:
+                return None
+            with open(cache_path, "rb") as f:
+                return orjson.loads(f.read())["text"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    def _write_cached_text(self, key: str, text: str, filename: str):
+        """Store extracted text for this content (written to a temp file, then renamed into place)"""
+        cache_path = self._cache_path(key)
+        try:
+            os.makedirs(settings.parse_cache_directory, exist_ok=True)
+            # Unique temp name, so concurrent writers of the same key never share a file
+            fd, temp_path = tempfile.mkstemp(dir=settings.parse_cache_directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(orjson.dumps({"text": text, "source_filename": filename}))
+                os.replace(temp_path, cache_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Failed to cache extracted text for {filename}: {e}")
+    
+    def _prune_parse_cache(self):
+        """Delete cache entries past PARSE_CACHE_TTL_SECONDS"""
+        cutoff = time.time() - PARSE_CACHE_TTL_SECONDS
+        removed = 0
+        try:
+            with os.scandir(settings.parse_cache_directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                            os.unlink(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Failed to prune parse cache: {e}")
+        if removed:
+            logger.info(f"Pruned {removed} expired parse cache entries")
+    
+    async def _cache_text(self, key: str, text: str, filename: str):
+        """Cache extracted text, pruning expired entries at most once per prune interval"""
+        await self._run_blocking(self._write_cached_text, key, text, filename)
+        now = time.monotonic()
+        if self._last_cache_prune is None or now - self._last_cache_prune >= PARSE_CACHE_PRUNE_INTERVAL_SECONDS:
+            self._last_cache_prune = now
+            await self._run_blocking(self._prune_parse_cache)
+    
+    async def remove_cached_text(self, content_hash: Optional[str]):
+        """Delete the cached text of a file's content, e.g. when the file is deleted"""
+        if not content_hash:
+            return
+        try:
+            await self._run_blocking(os.unlink, self._cache_path(content_hash))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove cached text {content_hash}: {e}")
+    
+    async def content_hash(self, file_path: str) -> str:
+        """Hash of a file's bytes, identifying re-uploads of the same document"""
+        return await self._run_blocking(self._content_key, file_path)
+    
+    async def extract_text_from_file(self, file_path: str, filename: str, content_hash: Optional[str] = None) -> str:
+        """
+        Extract text from a PDF already on disk using LlamaParse with proper error handling.
+        Pass content_hash if the caller already hashed the file.
+        """
+        try:
+            # One stat both verifies the file is there and gives its size
+            try:
+                file_size = os.stat(file_path).st_size
+            except FileNotFoundError:
+                raise Exception(f"File does not exist: {file_path}")
             
-            file_size = os.path.getsize(temp_file_path)
             logger.info(f"Starting PDF text extraction for {filename} ({file_size} bytes)")
             
             if file_size == 0:
                 raise Exception("PDF file is empty or corrupted")
             
+            # Identical bytes parsed before (re-uploads, retries) skip the paid LlamaParse call
+            cache_key = content_hash or await self.content_hash(file_path)
+            cached_text = await self._run_blocking(self._read_cached_text, cache_key)
+            if cached_text:
+                logger.info(f"Using cached text for {filename} ({len(cached_text)} characters)")
+                return cached_text
+            
+            # Born-digital PDFs: read the embedded text layer locally, no LlamaParse round-trip
+            page_texts = await self._run_blocking(self._read_text_layer, file_path)
+            if page_texts and all(len(text) >= TEXT_LAYER_MIN_PAGE_CHARS for text in page_texts):
+                full_text = "\n".join(page_texts)
+                logger.info(f"Extracted {len(full_text)} characters from the text layer of {filename}, skipping LlamaParse")
+                await self._cache_text(cache_key, full_text, filename)
+                return full_text
+            
+            # Real (if short) text on every page -> fast mode; any page with little or no text
+            # may be a scanned image -> OCR
+            has_text_layer = bool(page_texts) and all(
+                len(text) >= FAST_PARSE_MIN_PAGE_CHARS for text in page_texts
+            )
+            parse_options = FAST_PARSE_OPTIONS if has_text_layer else ACCURATE_PARSE_OPTIONS
+            logger.info(f"Using {'fast' if has_text_layer else 'accurate'} LlamaParse mode for {filename}")
+            
             # Use proper async handling with retries
-            documents = await self._parse_with_retries(temp_file_path, filename)
+            documents = await self._parse_with_retries(file_path, filename, parse_options, len(page_texts))
             
             if not documents:
                 raise Exception("No documents returned from LlamaParse")
             
             logger.info(f"LlamaParse returned {len(documents)} documents for {filename}")
             
-            # Combine all document text
-            full_text = ""
+            # Pick how to read text from the document type once, not per document
+            get_text = _document_text_getter(documents[0])
+            parts: List[str] = []
             for i, doc in enumerate(documents):
-                doc_text = ""
                 try:
-                    # Handle different response formats
-                    if hasattr(doc, 'text') and doc.text:
-                        doc_text = doc.text
-                    elif hasattr(doc, 'get_content'):
-                        content = doc.get_content()
-                        if content:
-                            doc_text = content
-                    elif hasattr(doc, 'page_content'):
-                        page_content = getattr(doc, 'page_content', None)
-                        if page_content:
-                            doc_text = page_content
-                    elif isinstance(doc, dict) and 'text' in doc:
-                        doc_text = doc['text']
-                    elif isinstance(doc, str) and doc.strip():
-                        doc_text = doc
-                    else:
-                        # Fallback - try to convert to string
-                        doc_str = str(doc)
-                        if doc_str and doc_str != "None":
-                            doc_text = doc_str
-                    
+                    doc_text = get_text(doc)
                     if doc_text:
-                        full_text += doc_text + "\n"
+                        parts.append(doc_text)
                         logger.info(f"Document {i+1}: {len(doc_text)} characters")
                     else:
                         logger.warning(f"Document {i+1}: No text content found")
@@ -96,30 +277,22 @@ class PDFProcessingService:
                     logger.warning(f"Error processing document {i+1} for {filename}: {str(doc_error)}")
                     continue
             
-            # Clean up temporary file
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            
             # Validate extracted text
-            if not full_text.strip():
+            full_text = "\n".join(parts).strip()
+            if not full_text:
                 raise Exception("No text content could be extracted from PDF")
             
             logger.info(f"Successfully extracted text from {filename}. Total length: {len(full_text)} characters")
-            return full_text.strip()
+            await self._cache_text(cache_key, full_text, filename)
+            return full_text
             
         except Exception as e:
-            # Clean up temporary file in case of error
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                except Exception as cleanup_error:
-                    logger.warning(f"Failed to cleanup temp file: {cleanup_error}")
-            
             error_msg = f"Failed to extract text from PDF: {str(e)}"
             logger.error(f"Error extracting text from {filename}: {error_msg}")
             raise Exception(error_msg)
     
-    async def _parse_with_retries(self, file_path: str, filename: str, max_retries: int = 3):
+    async def _parse_with_retries(self, file_path: str, filename: str, parse_options: dict,
+                                  page_count: int = 0, max_retries: int = 3):
         """
         Parse PDF with retry logic to handle LlamaParse issues
         """
@@ -127,19 +300,17 @@ class PDFProcessingService:
             try:
                 logger.info(f"Parsing attempt {attempt + 1}/{max_retries} for {filename}")
                 
-                # Add a small delay before each attempt
+                # Jittered exponential backoff before each retry
                 if attempt > 0:
-                    wait_time = 2 ** (attempt - 1)  # Exponential backoff
-                    logger.info(f"Waiting {wait_time} seconds before retry...")
+                    wait_time = min(
+                        PARSE_RETRY_MAX_DELAY,
+                        PARSE_RETRY_BASE_DELAY * 2 ** (attempt - 1) * (1 + random.uniform(0, 0.5))
+                    )
+                    logger.info(f"Waiting {wait_time:.1f} seconds before retry...")
                     await asyncio.sleep(wait_time)
                 
-                # Run in executor to avoid blocking
-                loop = asyncio.get_event_loop()
-                documents = await loop.run_in_executor(
-                    None, 
-                    self._blocking_parse, 
-                    file_path
-                )
+                # Submit a LlamaParse job and wait on the shared poller - no thread per parse
+                documents = await self._parse(file_path, parse_options, page_count)
                 
                 if documents:
                     logger.info(f"Successfully parsed {filename} on attempt {attempt + 1}")
@@ -149,65 +320,85 @@ class PDFProcessingService:
                     
             except Exception as e:
                 logger.warning(f"Parse attempt {attempt + 1} failed for {filename}: {str(e)}")
-                if attempt == max_retries - 1:  # Last attempt
+                if attempt == max_retries - 1 or not _is_retryable(e):  # Last attempt or permanent error
                     raise e
         
         raise Exception(f"All {max_retries} parsing attempts failed")
     
-    def _blocking_parse(self, file_path: str):
+    def _read_text_layer(self, file_path: str) -> List[str]:
         """
-        Blocking parse method for executor with better error handling
+        Extract the embedded text of every page with pypdf (empty list if the PDF can't be read)
         """
         try:
-            # Add a small delay to ensure file is ready
-            import time
-            time.sleep(0.5)
-            
-            # Verify file exists and is readable
-            if not os.path.exists(file_path):
-                raise Exception(f"File does not exist: {file_path}")
+            return [(page.extract_text() or "").strip() for page in PdfReader(file_path).pages]
+        except Exception as e:
+            logger.warning(f"Text layer extraction failed for {file_path}: {str(e)}")
+            return []
+    
+    def _split_pages(self, file_path: str, output_dir: str) -> List[str]:
+        """
+        Write every PAGE_RANGE_SIZE pages of the PDF to their own file in output_dir,
+        returning the paths in page order
+        """
+        reader = PdfReader(file_path)
+        page_count = len(reader.pages)
+        range_paths = []
+        for start in range(0, page_count, PAGE_RANGE_SIZE):
+            writer = PdfWriter()
+            for index in range(start, min(start + PAGE_RANGE_SIZE, page_count)):
+                writer.add_page(reader.pages[index])
+            range_path = os.path.join(output_dir, f"pages-{start + 1}-{index + 1}.pdf")
+            with open(range_path, "wb") as f:
+                writer.write(f)
+            range_paths.append(range_path)
+        return range_paths
+    
+    async def _submit_parse(self, file_path: str, parse_options: dict) -> str:
+        """Run one LlamaParse job once the rate limiter admits its submission"""
+        async with self._limiter:
+            return await self.parser.parse(file_path, parse_options)
+    
+    async def _parse(self, file_path: str, parse_options: dict, page_count: int = 0):
+        """
+        Parse a PDF with LlamaParse, returning its markdown as a single document.
+        Large PDFs are split into page ranges parsed as concurrent jobs and stitched in order.
+        """
+        try:
+            # Existence and size were already checked by extract_text_from_file
+            logger.info(f"Parsing file: {file_path}")
             
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                raise Exception("File is empty")
-            
-            logger.info(f"Parsing file: {file_path} ({file_size} bytes)")
-            
-            # Create a fresh parser instance for this sync operation
-            # This avoids event loop conflicts
-            from llama_parse import LlamaParse, ResultType
-            from app.config import settings
-            sync_parser = LlamaParse(
-                api_key=settings.llama_cloud_api_key,
-                result_type=ResultType.MD,
-                disable_ocr=False,
-                auto_mode=True,
-                auto_mode_trigger_on_image_in_page=True,
-                verbose=True,
-                language="en"
-        )
-
-            # Use load_data method with error handling
-            documents = sync_parser.load_data(file_path)
+            if page_count > LARGE_PDF_PAGES:
+                # Each job uploads only its own pages, not another copy of the whole PDF
+                async with aiofiles.tempfile.TemporaryDirectory() as split_dir:
+                    range_paths = await self._run_blocking(self._split_pages, file_path, split_dir)
+                    logger.info(f"Splitting {page_count}-page PDF into {len(range_paths)} LlamaParse jobs")
+                    
+                    semaphore = asyncio.Semaphore(PAGE_RANGE_CONCURRENCY)
+                    
+                    async def parse_range(range_path: str) -> str:
+                        async with semaphore:
+                            return await self._submit_parse(range_path, parse_options)
+                    
+                    parts = await asyncio.gather(*[parse_range(range_path) for range_path in range_paths])
+                markdown = "\n".join(part for part in parts if part)
+            else:
+                markdown = await self._submit_parse(file_path, parse_options)
             
             # Validate the result
-            if documents is None:
-                logger.warning("Parser returned None")
+            if not markdown:
+                logger.warning("Parser returned no text")
                 return []
             
-            if not isinstance(documents, list):
-                logger.info("Parser returned single document, converting to list")
-                documents = [documents]
-            
-            logger.info(f"Parser returned {len(documents)} documents")
-            return documents
+            logger.info(f"Parser returned {len(markdown)} characters")
+            return [markdown]
             
         except Exception as e:
-            logger.error(f"Blocking parse failed: {str(e)}")
+            logger.error(f"Parse failed: {str(e)}")
             raise
-    
-    def _parse_sync(self, file_path: str):
-        """Synchronous parsing method for executor (legacy)"""
-        return self._blocking_parse(file_path)
+
+    async def close(self):
+        """Stop the LlamaParse job poller, close its HTTP client and shut down the thread pool"""
+        await self.parser.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 pdf_processing_service = PDFProcessingService()
@@ -1,212 +1,382 @@
 import asyncio
 import logging
-from typing import Dict, List, Optional
+import random
+from typing import Dict, List, Optional, Set
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import insert, or_, select, update
 from app.database import AsyncSessionLocal
 from app.models import File, FileMetadata, ProcessingError
 from app.services.cloudinary_service import cloudinary_service
 from app.services.pdf_processing import pdf_processing_service
 from app.services.vector_processing_friend import friend_vector_processing_service
-from app.services.metadata_extraction import metadata_extraction_service
+from app.services.metadata_extraction import get_metadata_extraction_service
 from app.config import settings
 from app.websocket import manager
+from app.utils.exceptions import ProcessingException, ValidationException
+from google.api_core import exceptions as google_exceptions
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Backoff between attempts at a whole file: exponential with up to 50% jitter, capped
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 30.0
+
+# Statuses of files accepted but not yet finished
+UNFINISHED_STATUSES = ("pending", "processing")
+
+# Unfinished files that were already attempted this many times are failed instead of recovered,
+# so a file that takes the process down with it isn't retried on every restart
+MAX_ATTEMPTS = 3
+
+# How often recovery looks again for unfinished files it couldn't queue because the queue was full
+RECOVERY_SWEEP_INTERVAL = 30.0
+
+# Error rows are buffered and inserted together once this many are pending,
+# or ERROR_FLUSH_INTERVAL seconds after the first of them was buffered
+ERROR_FLUSH_SIZE = 16
+ERROR_FLUSH_INTERVAL = 0.5
+
+# Errors that will fail the same way on every attempt
+PERMANENT_ERRORS = (
+    ProcessingException,
+    ValidationException,
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+    google_exceptions.NotFound,
+)
+
+def _is_retryable(error: BaseException) -> bool:
+    """Whether retrying the file could help; checks the whole chain of wrapped exceptions"""
+    while error is not None:
+        if isinstance(error, PERMANENT_ERRORS):
+            return False
+        # Client errors other than timeouts / rate limits (bad request, auth) won't succeed on retry
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+            return False
+        error = error.__cause__ or error.__context__
+    return True
+
+def _safe_int_convert(value):
+    """Safely convert a value to integer"""
+    if value is None or value == "" or value == "N/A":
+        return None
+    try:
+        return int(value) if isinstance(value, str) else value
+    except (ValueError, TypeError):
+        return None
+
+def _safe_float_convert(value):
+    """Safely convert a value to float"""
+    if value is None or value == "" or value == "N/A":
+        return None
+    try:
+        return float(value) if isinstance(value, str) else value
+    except (ValueError, TypeError):
+        return None
+
+def _classify_risk(risk_score):
+    """Return the (risk band, risk colour) for an overall risk score"""
+    if risk_score is None:
+        return None, None
+    if risk_score <= 0.67:
+        return "Low", "green"
+    elif risk_score <= 1.33:
+        return "Medium", "yellow"
+    else:
+        return "High", "red"
+
 class ProcessingQueue:
+    """
+    Runs every queued file as its own task. A semaphore caps how many files are processed
+    at once; CPU-bound PDF work is further limited by the PDF service's own thread pool.
+    """
+
     def __init__(self):
-        self.queue: asyncio.Queue = asyncio.Queue()
-        self.workers: List[asyncio.Task] = []
+        self.tasks: Set[asyncio.Task] = set()
         self.is_running = False
-        self.max_concurrent_workers = settings.max_concurrent_processes
+        self.max_concurrent_files = settings.max_concurrent_files
+        # Queued + in-flight files allowed before new uploads are turned away
+        self.max_queue_depth = settings.queue_max_depth
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_files)
+        self._active = 0
+        # Slots held by uploads that are still storing their file before queueing it
+        self._reserved = 0
+        self._retries = 0
+        self._failed_files = 0
+        
+        # Error rows waiting for the next bulk INSERT
+        self._error_buffer: List[Dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_event = asyncio.Event()
+        # One-shot timer armed when the buffer stops being empty, so the flush task only wakes
+        # when there is something to write
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._recovery_task: Optional[asyncio.Task] = None
+        # Files uploaded before this belong to a previous run (upload_timestamp is UTC)
+        self._started_at: Optional[datetime] = None
     
     async def start(self):
-        """Start the processing queue workers"""
+        """Start accepting files for processing"""
         if self.is_running:
             return
         
         self.is_running = True
-        logger.info(f"Starting {self.max_concurrent_workers} processing workers")
+        self._started_at = datetime.utcnow()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Processing up to {self.max_concurrent_files} files concurrently")
         
-        # Create worker tasks
-        for i in range(self.max_concurrent_workers):
-            worker = asyncio.create_task(self._worker(f"worker-{i}"))
-            self.workers.append(worker)
+        # Pending work only lives in memory, so pick up what the last run left unfinished
+        self._recovery_task = asyncio.create_task(self._recover_unfinished_files())
     
     async def stop(self):
-        """Stop the processing queue workers"""
+        """Cancel in-flight processing tasks"""
         if not self.is_running:
             return
         
         self.is_running = False
-        logger.info("Stopping processing workers")
+        logger.info("Stopping file processing")
         
-        # Cancel all workers
-        for worker in self.workers:
-            worker.cancel()
+        if self._recovery_task is not None:
+            self._recovery_task.cancel()
+            await asyncio.gather(self._recovery_task, return_exceptions=True)
+            self._recovery_task = None
         
-        # Wait for all workers to finish
-        await asyncio.gather(*self.workers, return_exceptions=True)
-        self.workers.clear()
-    
-    def _safe_int_convert(self, value):
-        """Safely convert a value to integer"""
-        if value is None or value == "" or value == "N/A":
-            return None
-        try:
-            return int(value) if isinstance(value, str) else value
-        except (ValueError, TypeError):
-            return None
+        # Cancel all tasks
+        for task in self.tasks:
+            task.cancel()
+        
+        # Wait for all tasks to finish
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        
+        # Write out whatever rows are still buffered
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self._flush_buffers()
     
-    def _safe_float_convert(self, value):
-        """Safely convert a value to float"""
-        if value is None or value == "" or value == "N/A":
-            return None
-        try:
-            return float(value) if isinstance(value, str) else value
-        except (ValueError, TypeError):
-            return None
+    def is_full(self) -> bool:
+        """Whether the queue has reached its depth limit and should refuse new files"""
+        return len(self.tasks) + self._reserved >= self.max_queue_depth
     
-    def _calculate_risk_band(self, risk_score):
-        """Calculate risk band based on risk score"""
-        if risk_score is None:
-            return None
-        if risk_score <= 0.67:
-            return "Low"
-        elif risk_score <= 1.33:
-            return "Medium"
-        else:
-            return "High"
+    def try_reserve(self) -> bool:
+        """
+        Hold a queue slot for a file that will be queued once it is stored. Returns False when
+        the queue is full. The slot is handed over by add_file_for_processing(reserved=True)
+        or given back with release_reservation.
+        """
+        if self.is_full():
+            return False
+        self._reserved += 1
+        return True
     
-    def _calculate_risk_color(self, risk_score):
-        """Calculate risk color based on risk score"""
-        if risk_score is None:
-            return None
-        if risk_score <= 0.67:
-            return "green"
-        elif risk_score <= 1.33:
-            return "yellow"
-        else:
-            return "red"
+    def release_reservation(self):
+        """Give back a slot taken with try_reserve that won't be used"""
+        self._reserved -= 1
     
-    async def add_file_for_processing(self, file_id: str, file_content: bytes, filename: str):
-        """Add a file to the processing queue"""
-        task = {
-            "file_id": file_id,
-            "file_content": file_content,
-            "filename": filename,
-            "timestamp": datetime.utcnow()
-        }
-        await self.queue.put(task)
-        logger.info(f"Added file {filename} ({file_id}) to processing queue")
+    async def add_file_for_processing(self, file_id: str, file_content: bytes, filename: str,
+                                      reserved: bool = False):
+        """Add a file to the processing queue, using a slot from try_reserve when reserved is set"""
+        try:
+            if not reserved and self.is_full():
+                raise ProcessingException(
+                    f"Processing queue is full ({self.max_queue_depth} files), try again later",
+                    error_type="queue_full"
+                )
+            
+            # Spool the upload to disk once; the task only holds the path, not the bytes
+            file_path = await pdf_processing_service.write_temp_pdf(file_content)
+            task = asyncio.create_task(self._run_with_semaphore(file_id, file_path, filename))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        finally:
+            if reserved:
+                self.release_reservation()
+        logger.info("Added file %s (%s) to processing queue", filename, file_id)
     
-    async def _worker(self, worker_name: str):
-        """Worker process to handle file processing"""
-        logger.info(f"Started worker: {worker_name}")
+    async def _recover_unfinished_files(self):
+        """
+        Re-queue files a previous run accepted but never finished. The files table is the
+        durable record: anything uploaded before this run started that is still pending or
+        processing was lost with the old process, so its PDF is fetched back from Cloudinary
+        and processed again. Files that don't fit in the queue are picked up by a later sweep.
+        Files that already used up MAX_ATTEMPTS are marked failed rather than queued again.
+        """
+        recovered: Set[str] = set()
+        unfinished_before_start = (
+            File.upload_timestamp < self._started_at,
+            or_(
+                File.vector_processing_status.in_(UNFINISHED_STATUSES),
+                File.metadata_processing_status.in_(UNFINISHED_STATUSES)
+            )
+        )
+        # Done once up front: attempts only grow for files this run has already recovered
+        exhausted_error = f"Gave up after {MAX_ATTEMPTS} processing attempts"
+        try:
+            async with AsyncSessionLocal() as db:
+                exhausted = await db.execute(
+                    update(File)
+                    .where(*unfinished_before_start, File.processing_attempts >= MAX_ATTEMPTS)
+                    .values(
+                        vector_processing_status="failed",
+                        metadata_processing_status="failed",
+                        vector_processing_error=exhausted_error,
+                        metadata_processing_error=exhausted_error
+                    )
+                )
+                await db.commit()
+            if exhausted.rowcount:
+                logger.warning(f"Marked {exhausted.rowcount} unfinished files as failed "
+                               f"after {MAX_ATTEMPTS} processing attempts")
+        except Exception as e:
+            logger.error(f"Could not fail exhausted unfinished files: {str(e)}")
         
-        while self.is_running:
+        while True:
             try:
-                # Get task from queue with timeout
-                task = await asyncio.wait_for(self.queue.get(), timeout=1.0)
-                
-                file_id = task["file_id"]
-                file_content = task["file_content"]
-                filename = task["filename"]
-                
-                logger.info(f"{worker_name} processing file: {filename} ({file_id})")
+                async with AsyncSessionLocal() as db:
+                    stmt = select(File.id, File.filename, File.cloudinary_url).where(
+                        *unfinished_before_start,
+                        File.processing_attempts < MAX_ATTEMPTS
+                    ).order_by(File.upload_timestamp)
+                    unfinished = [row for row in (await db.execute(stmt)).all() if row.id not in recovered]
+            except Exception as e:
+                logger.error(f"Could not look up unfinished files: {str(e)}")
+                unfinished = None
+            
+            if unfinished is not None:
+                if not unfinished:
+                    return
+                logger.info(f"Recovering {len(unfinished)} unfinished files from a previous run")
                 
-                # Process the file with retry logic
-                max_retries = 3
-                for attempt in range(1, max_retries + 1):
+                for file_id, filename, cloudinary_url in unfinished:
+                    if not self.try_reserve():
+                        logger.info("Processing queue is full, remaining unfinished files are retried "
+                                    "in %.0fs", RECOVERY_SWEEP_INTERVAL)
+                        break
+                    # Whatever happens to this file, it is not looked at again by this run
+                    recovered.add(file_id)
                     try:
-                        await self._process_file(file_id, file_content, filename, worker_name)
-                        break  # Success, exit retry loop
+                        file_content = await cloudinary_service.download_file(cloudinary_url)
                     except Exception as e:
-                        logger.error(f"{worker_name} error processing {filename} (attempt {attempt}): {str(e)}")
-                        if attempt < max_retries:
-                            await asyncio.sleep(5)  # Wait before retry
-                        else:
-                            logger.error(f"{worker_name} failed to process {filename} after {max_retries} attempts.")
-                            # Mark as failed in DB (already handled in _process_file)
-                            break
-                # Mark task as done
-                self.queue.task_done()
-                
-            except asyncio.TimeoutError:
-                # Continue loop if no task available
-                continue
-            except asyncio.CancelledError:
-                # Worker cancelled
-                break
-            except Exception as e:
-                logger.error(f"{worker_name} error processing task: {str(e)}")
-                # Mark task as done even if it failed
-                self.queue.task_done()
+                        self.release_reservation()
+                        await self._mark_recovery_failed(file_id, filename, e)
+                        continue
+                    try:
+                        await self.add_file_for_processing(file_id, file_content, filename, reserved=True)
+                    except Exception as e:
+                        await self._mark_recovery_failed(file_id, filename, e)
+                else:
+                    return
+            
+            await asyncio.sleep(RECOVERY_SWEEP_INTERVAL)
+    
+    async def _mark_recovery_failed(self, file_id: str, filename: str, error: Exception):
+        """Fail a file that couldn't be recovered instead of leaving it pending"""
+        error_message = f"Failed to recover file {filename}: {str(error)}"
+        logger.error(error_message)
+        try:
+            async with AsyncSessionLocal() as db:
+                await self._set_file_state(
+                    db, file_id,
+                    vector_processing_status="failed",
+                    metadata_processing_status="failed",
+                    vector_processing_error=error_message,
+                    metadata_processing_error=error_message
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Could not mark {filename} ({file_id}) as failed: {str(e)}")
+    
+    async def _run_with_semaphore(self, file_id: str, file_path: str, filename: str):
+        """Wait for a processing slot, then process the file with retries"""
+        try:
+            async with self._semaphore:
+                self._active += 1
+                try:
+                    await self._process_with_retries(file_id, file_path, filename)
+                finally:
+                    self._active -= 1
+        finally:
+            # Retries reuse the spooled file, so it is removed only once we're done with it
+            pdf_processing_service.remove_temp_pdf(file_path)
+    
+    async def _process_with_retries(self, file_id: str, file_path: str, filename: str):
+        """Process a file, retrying the whole pipeline with backoff on failure"""
+        worker_name = f"task-{file_id[:8]}"
+        logger.info("%s processing file: %s (%s)", worker_name, filename, file_id)
         
-        logger.info(f"Stopped worker: {worker_name}")
+        max_retries = 3
+        for attempt in range(1, max_retries + 1):
+            try:
+                await self._process_file(file_id, file_path, filename, worker_name)
+                break  # Success, exit retry loop
+            except Exception as e:
+                logger.error(f"{worker_name} error processing {filename} (attempt {attempt}): {str(e)}")
+                if attempt < max_retries and _is_retryable(e):
+                    self._retries += 1
+                    delay = min(
+                        RETRY_MAX_DELAY,
+                        RETRY_BASE_DELAY * 2 ** (attempt - 1) * (1 + random.uniform(0, 0.5))
+                    )
+                    await asyncio.sleep(delay)  # Wait before retry
+                else:
+                    self._failed_files += 1
+                    logger.error(f"{worker_name} failed to process {filename} after {attempt} attempts.")
+                    # Mark as failed in DB (already handled in _process_file)
+                    break
     
-    async def _process_file(self, file_id: str, file_content: bytes, filename: str, worker_name: str):
+    async def _process_file(self, file_id: str, file_path: str, filename: str, worker_name: str):
         """Process a single file - PDF extraction, vector processing, and metadata extraction"""
         async with AsyncSessionLocal() as db:
             try:
-                # Update processing attempts
-                await self._increment_processing_attempts(db, file_id)
+                # Hash the upload first: re-uploads of a processed file skip the whole pipeline
+                content_hash = await pdf_processing_service.content_hash(file_path)
+                await self._set_file_state(
+                    db, file_id,
+                    processing_attempts=File.processing_attempts + 1,
+                    vector_processing_status="processing",
+                    metadata_processing_status="processing",
+                    content_hash=content_hash
+                )
                 
-                # Step 1: Extract text from PDF
-                logger.info(f"{worker_name} extracting text from {filename}")
-                await self._update_processing_status(db, file_id, "vector_processing_status", "processing")
-                
-                extracted_text = await pdf_processing_service.extract_text_from_pdf(file_content, filename)
-                logger.info(f"{worker_name} extracted {len(extracted_text)} characters from {filename}")
-                
-                # Step 2: Process vectors (chunking, embedding, storing)
-                logger.info(f"{worker_name} processing vectors for {filename}")
-                await friend_vector_processing_service.process_text_to_vectors(file_id, extracted_text)
+                if await self._reuse_duplicate(db, file_id, content_hash, filename, worker_name):
+                    return
                 
-                # Mark vector processing as completed
-                await self._update_processing_status(db, file_id, "vector_processing_status", "completed")
-                logger.info(f"{worker_name} completed vector processing for {filename}")
-                
-                # Send WebSocket notification for vector processing completion
-                try:
-                    await manager.notify_vector_processing_complete(file_id)
-                    await manager.notify_file_processing_update(
-                        file_id=file_id,
-                        status="vector_completed"
-                    )
-                except Exception as ws_error:
-                    logger.warning(f"Failed to send WebSocket notification for vector completion {file_id}: {ws_error}")
-                
-                # Step 3: Extract metadata
-                logger.info(f"{worker_name} extracting metadata from {filename}")
-                await self._update_processing_status(db, file_id, "metadata_processing_status", "processing")
+                # Step 1: Extract text from PDF
+                logger.debug("%s extracting text from %s", worker_name, filename)
+                extracted_text = await pdf_processing_service.extract_text_from_file(file_path, filename, content_hash)
+                logger.debug("%s extracted %d characters from %s", worker_name, len(extracted_text), filename)
                 
-                metadata = await metadata_extraction_service.extract_metadata(extracted_text, file_id)
+                # Steps 2 and 3: vectors and metadata only share the text, so run them concurrently
+                results = await asyncio.gather(
+                    self._process_vectors(file_id, extracted_text, filename, worker_name),
+                    self._extract_metadata(file_id, extracted_text, filename, worker_name),
+                    return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+                metadata = results[1]
                 
-                # Store metadata in database
+                # Mark both stages completed; the metadata row commits with the status, so a
+                # completed file always has its metadata
+                await self._set_file_state(
+                    db, file_id,
+                    vector_processing_status="completed",
+                    metadata_processing_status="completed"
+                )
                 await self._store_metadata(db, file_id, metadata, len(extracted_text))
                 
-                # Mark metadata processing as completed
-                await self._update_processing_status(db, file_id, "metadata_processing_status", "completed")
-                logger.info(f"{worker_name} completed metadata extraction for {filename}")
-                
-                # Send WebSocket notification for metadata extraction completion
-                try:
-                    await manager.notify_metadata_extracted(file_id, metadata)
-                    await manager.notify_file_processing_update(
-                        file_id=file_id,
-                        status="metadata_completed",
-                        metadata=metadata
-                    )
-                except Exception as ws_error:
-                    logger.warning(f"Failed to send WebSocket notification for {file_id}: {ws_error}")
-                
                 # Commit all changes
                 await db.commit()
-                logger.info(f"{worker_name} successfully processed {filename} ({file_id})")
+                await self._notify_metadata_completed(file_id, metadata)
+                logger.info("%s successfully processed %s (%s)", worker_name, filename, file_id)
                 
             except Exception as e:
                 await db.rollback()
@@ -214,36 +384,121 @@ class ProcessingQueue:
                 logger.error(f"{worker_name} {error_message}")
                 
                 # Log error to database
-                await self._log_processing_error(db, file_id, "processing", error_message, str(e))
+                self._log_processing_error(file_id, "processing", error_message, str(e))
                 
                 # Mark processing as failed
-                await self._update_processing_status(db, file_id, "vector_processing_status", "failed")
-                await self._update_processing_status(db, file_id, "metadata_processing_status", "failed")
-                await self._update_processing_error(db, file_id, "vector_processing_error", error_message)
-                await self._update_processing_error(db, file_id, "metadata_processing_error", error_message)
+                await self._set_file_state(
+                    db, file_id,
+                    vector_processing_status="failed",
+                    metadata_processing_status="failed",
+                    vector_processing_error=error_message,
+                    metadata_processing_error=error_message
+                )
                 
                 await db.commit()
+                # Let the caller decide whether to retry
+                raise
     
-    async def _increment_processing_attempts(self, db: AsyncSession, file_id: str):
-        """Increment processing attempts counter"""
-        stmt = update(File).where(File.id == file_id).values(
-            processing_attempts=File.processing_attempts + 1
+    async def _reuse_duplicate(self, db: AsyncSession, file_id: str, content_hash: str,
+                               filename: str, worker_name: str) -> bool:
+        """
+        If a file with the same content was already processed, copy its vectors and metadata
+        to this file and commit it as completed. Returns False when there is nothing to reuse.
+        """
+        stmt = select(File.id).where(
+            File.content_hash == content_hash,
+            File.id != file_id,
+            File.vector_processing_status == "completed",
+            File.metadata_processing_status == "completed"
+        ).limit(1)
+        source_file_id = (await db.execute(stmt)).scalar_one_or_none()
+        if source_file_id is None:
+            return False
+        
+        stmt = select(FileMetadata).where(FileMetadata.file_id == source_file_id).limit(1)
+        source_metadata = (await db.execute(stmt)).scalar_one_or_none()
+        if source_metadata is None:
+            return False
+        
+        copied_chunks = await friend_vector_processing_service.copy_file_vectors(source_file_id, file_id)
+        if not copied_chunks:
+            return False
+        
+        metadata = {
+            column.key: getattr(source_metadata, column.key)
+            for column in FileMetadata.__table__.columns
+        }
+        metadata.update(id=str(uuid.uuid4()), file_id=file_id, extraction_timestamp=datetime.utcnow())
+        await self._set_file_state(
+            db, file_id,
+            vector_processing_status="completed",
+            metadata_processing_status="completed"
         )
-        await db.execute(stmt)
+        await db.execute(insert(FileMetadata).values(**metadata))
+        await db.commit()
+        logger.info(f"{worker_name} reused {copied_chunks} chunks and metadata of {source_file_id} "
+                    f"for duplicate upload {filename} ({file_id})")
+        
+        try:
+            await manager.notify_vector_processing_complete(file_id)
+            await manager.notify_file_processing_update(
+                file_id=file_id,
+                status="metadata_completed",
+                metadata={
+                    key: value for key, value in metadata.items()
+                    if key not in ("id", "extraction_timestamp")
+                }
+            )
+        except Exception as ws_error:
+            logger.warning(f"Failed to send WebSocket notification for {file_id}: {ws_error}")
+        
+        return True
     
-    async def _update_processing_status(self, db: AsyncSession, file_id: str, status_field: str, status: str):
-        """Update processing status in database"""
-        stmt = update(File).where(File.id == file_id).values(**{status_field: status})
-        await db.execute(stmt)
+    async def _process_vectors(self, file_id: str, text: str, filename: str, worker_name: str):
+        """Chunk, embed and store the text, notifying clients as soon as it's done"""
+        logger.debug("%s processing vectors for %s", worker_name, filename)
+        await friend_vector_processing_service.process_text_to_vectors(file_id, text)
+        logger.debug("%s completed vector processing for %s", worker_name, filename)
+        
+        # Send WebSocket notification for vector processing completion
+        try:
+            await manager.notify_vector_processing_complete(file_id)
+            await manager.notify_file_processing_update(
+                file_id=file_id,
+                status="vector_completed"
+            )
+        except Exception as ws_error:
+            logger.warning(f"Failed to send WebSocket notification for vector completion {file_id}: {ws_error}")
     
-    async def _update_processing_error(self, db: AsyncSession, file_id: str, error_field: str, error_message: str):
-        """Update processing error in database"""
-        stmt = update(File).where(File.id == file_id).values(**{error_field: error_message})
+    async def _extract_metadata(self, file_id: str, text: str, filename: str, worker_name: str) -> Dict:
+        """Extract contract metadata"""
+        logger.debug("%s extracting metadata from %s", worker_name, filename)
+        metadata = await get_metadata_extraction_service().extract_metadata(text, file_id)
+        logger.debug("%s completed metadata extraction for %s", worker_name, filename)
+        return metadata
+    
+    async def _notify_metadata_completed(self, file_id: str, metadata: Dict):
+        """Tell clients the metadata is ready; only called once its row is committed"""
+        try:
+            await manager.notify_metadata_extracted(file_id, metadata)
+            await manager.notify_file_processing_update(
+                file_id=file_id,
+                status="metadata_completed",
+                metadata=metadata
+            )
+        except Exception as ws_error:
+            logger.warning(f"Failed to send WebSocket notification for {file_id}: {ws_error}")
+    
+    async def _set_file_state(self, db: AsyncSession, file_id: str, **fields):
+        """Update any processing columns of a file in a single UPDATE"""
+        stmt = update(File).where(File.id == file_id).values(**fields)
         await db.execute(stmt)
     
     async def _store_metadata(self, db: AsyncSession, file_id: str, metadata: Dict, text_length: int):
-        """Store extracted metadata in database"""
-        db_metadata = FileMetadata(
+        """Add the extracted metadata row to the file's transaction"""
+        risk_score = _safe_float_convert(metadata.get("overall_risk_score"))
+        risk_band, risk_color = _classify_risk(risk_score)
+        row = dict(
             id=str(uuid.uuid4()),
             file_id=file_id,
             contract_name=metadata.get("contract_name"),
@@ -268,31 +523,30 @@ class ProcessingQueue:
             price_escalation=metadata.get("price_escalation"),
             
             # Risk scores - these were also missing!
-            auto_renewal_risk_score=self._safe_int_convert(metadata.get("auto_renewal_risk_score")),
-            payment_terms_risk_score=self._safe_int_convert(metadata.get("payment_terms_risk_score")),
-            liability_cap_risk_score=self._safe_int_convert(metadata.get("liability_cap_risk_score")),
-            termination_risk_score=self._safe_int_convert(metadata.get("termination_convenience_risk_score")),  # Field name mapping
-            price_escalation_risk_score=self._safe_int_convert(metadata.get("price_escalation_risk_score")),
-            total_risk_score=self._safe_float_convert(metadata.get("overall_risk_score")),  # Field name mapping
-            risk_band=self._calculate_risk_band(self._safe_float_convert(metadata.get("overall_risk_score"))),
-            risk_color=self._calculate_risk_color(self._safe_float_convert(metadata.get("overall_risk_score"))),
+            auto_renewal_risk_score=_safe_int_convert(metadata.get("auto_renewal_risk_score")),
+            payment_terms_risk_score=_safe_int_convert(metadata.get("payment_terms_risk_score")),
+            liability_cap_risk_score=_safe_int_convert(metadata.get("liability_cap_risk_score")),
+            termination_risk_score=_safe_int_convert(metadata.get("termination_convenience_risk_score")),  # Field name mapping
+            price_escalation_risk_score=_safe_int_convert(metadata.get("price_escalation_risk_score")),
+            total_risk_score=risk_score,  # Field name mapping
+            risk_band=risk_band,
+            risk_color=risk_color,
             
             # Additional fields
             raw_text_length=text_length,
             extraction_timestamp=datetime.utcnow(),
             confidence_score=0.95  # Set a default confidence score
         )
-        db.add(db_metadata)
+        await db.execute(insert(FileMetadata).values(**row))
         
-        logger.info(f"Stored metadata including commercial terms for file {file_id}: "
-                   f"Auto-renewal: {metadata.get('auto_renewal')}, "
-                   f"Payment terms: {metadata.get('payment_terms')}, "
-                   f"Liability cap: {metadata.get('liability_cap')}, "
-                   f"Overall risk score: {metadata.get('overall_risk_score')}")
+        logger.debug("Stored metadata including commercial terms for file %s: "
+                     "Auto-renewal: %s, Payment terms: %s, Liability cap: %s, Overall risk score: %s",
+                     file_id, metadata.get('auto_renewal'), metadata.get('payment_terms'),
+                     metadata.get('liability_cap'), metadata.get('overall_risk_score'))
     
-    async def _log_processing_error(self, db: AsyncSession, file_id: str, error_type: str, error_message: str, error_details: str):
-        """Log processing error to database"""
-        error_record = ProcessingError(
+    def _log_processing_error(self, file_id: str, error_type: str, error_message: str, error_details: str):
+        """Queue a processing error for the next bulk insert"""
+        row = dict(
             id=str(uuid.uuid4()),
             file_id=file_id,
             error_type=error_type,
@@ -301,13 +555,58 @@ class ProcessingQueue:
             timestamp=datetime.utcnow(),
             resolved=False
         )
-        db.add(error_record)
+        self._error_buffer.append(row)
+        if len(self._error_buffer) >= ERROR_FLUSH_SIZE:
+            self._flush_event.set()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                ERROR_FLUSH_INTERVAL, self._flush_event.set
+            )
+    
+    async def _flush_loop(self):
+        """Flush buffered rows when enough are pending or the flush timer fires"""
+        while True:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            await self._flush_buffers()
+    
+    async def _flush_buffers(self):
+        """Insert all buffered error rows in one transaction"""
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            error_rows, self._error_buffer = self._error_buffer, []
+            if not error_rows:
+                return
+            
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(insert(ProcessingError), error_rows)
+                    await db.commit()
+                logger.info(f"Inserted {len(error_rows)} error rows")
+            except Exception as e:
+                # Don't let one bad row lose the rest of the batch
+                logger.error(f"Bulk insert of buffered rows failed, inserting individually: {str(e)}")
+                for row in error_rows:
+                    try:
+                        async with AsyncSessionLocal() as db:
+                            await db.execute(insert(ProcessingError).values(**row))
+                            await db.commit()
+                    except Exception as row_error:
+                        logger.error(f"Failed to insert processing error row for file "
+                                     f"{row.get('file_id')}: {str(row_error)}")
     
     async def get_queue_status(self) -> Dict:
         """Get current queue status"""
         return {
             "is_running": self.is_running,
-            "queue_size": self.queue.qsize(),
-            "active_workers": len([w for w in self.workers if not w.done()]),
-            "total_workers": len(self.workers)
+            "queue_size": len(self.tasks) - self._active,
+            "active_workers": self._active,
+            "total_workers": self.max_concurrent_files,
+            "queue_depth": len(self.tasks),
+            "max_queue_depth": self.max_queue_depth,
+            "is_full": self.is_full(),
+            "retries": self._retries,
+            "failed_files": self._failed_files
         }
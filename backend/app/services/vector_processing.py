@@ -1,18 +1,34 @@
+import asyncio
 import chromadb
 from chromadb.config import DEFAULT_TENANT, DEFAULT_DATABASE
 import google.generativeai as genai
 from app.config import settings
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
 import tiktoken
 import hashlib
 import os
+import sqlite3
+import threading
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 # Configure Google Generative AI
 genai.configure(api_key=settings.google_api_key)
 
+# Texts per embed_content request (the API accepts at most 100)
+EMBED_BATCH_SIZE = 100
+
+# Cached embeddings are kept as float16: half the size of float32 on disk, and the rounding
+# is far below what changes cosine-similarity rankings
+EMBEDDING_CACHE_DTYPE = np.float16
+
+def _hash_chunks(chunks: List[str]) -> List[bytes]:
+    """SHA-256 digest of each chunk, used as the embedding cache key and chunk_hash metadata"""
+    sha256 = hashlib.sha256
+    return [sha256(chunk.encode()).digest() for chunk in chunks]
+
 class VectorProcessingService:
     def __init__(self):
         # Initialize ChromaDB client with updated API
@@ -33,6 +49,17 @@ class VectorProcessingService:
         
         # Google embedding model
         self.embedding_model = "models/text-embedding-004"
+        
+        # Embeddings of previously seen chunks, keyed by the chunk's SHA-256 and the embedding
+        # model. Contracts reuse a lot of boilerplate clauses, so many chunks never need a
+        # second API call
+        self._embedding_cache = sqlite3.connect(settings.embedding_cache_path, check_same_thread=False)
+        self._embedding_cache.execute("PRAGMA journal_mode=WAL")
+        self._embedding_cache.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache (chunk_sha256 BLOB, model TEXT, embedding BLOB, "
+            "PRIMARY KEY (chunk_sha256, model))"
+        )
+        self._embedding_cache_lock = threading.Lock()
     
     def chunk_text(self, text: str, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None) -> List[str]:
         """
@@ -42,6 +69,8 @@ class VectorProcessingService:
             chunk_size = settings.chunk_size
         if chunk_overlap is None:
             chunk_overlap = settings.chunk_overlap
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
         
         # Handle empty or very short text
         if not text or not text.strip():
@@ -61,64 +90,122 @@ class VectorProcessingService:
             logger.warning("No tokens generated from text")
             return []
             
-        chunks = []
+        # A chunk starts every (chunk_size - chunk_overlap) tokens. Starting at or past
+        # len - overlap would only repeat the previous chunk's overlap, so the last chunk
+        # always reaches the end of the text and nothing is dropped or emitted twice
+        starts = range(0, max(1, len(tokens) - chunk_overlap), chunk_size - chunk_overlap)
+        token_slices = [tokens[i:i + chunk_size] for i in starts]
         
-        for i in range(0, len(tokens), chunk_size - chunk_overlap):
-            chunk_tokens = tokens[i:i + chunk_size]
-            if not chunk_tokens:  # Skip empty token lists
-                continue
-                
-            try:
-                chunk_text = self.tokenizer.decode(chunk_tokens)
-                if chunk_text.strip():  # Only add non-empty chunks
-                    chunks.append(chunk_text.strip())
-            except Exception as e:
-                logger.warning(f"Error decoding chunk at position {i}: {str(e)}")
-                continue
-            
-            # Stop if this is the last chunk
-            if i + chunk_size >= len(tokens):
-                break
+        # decode_batch decodes every slice in one call (tiktoken's Rust core, GIL released)
+        chunks = [chunk.strip() for chunk in self.tokenizer.decode_batch(token_slices)]
+        chunks = [chunk for chunk in chunks if chunk]  # Only keep non-empty chunks
         
         logger.info(f"Split text ({len(tokens)} tokens) into {len(chunks)} chunks")
         return chunks
     
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    async def chunk_text_async(self, text: str, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None) -> List[str]:
+        """
+        chunk_text in a worker thread, so tokenizing a large contract doesn't block the event loop
+        """
+        return await asyncio.to_thread(self.chunk_text, text, chunk_size, chunk_overlap)
+    
+    def _get_cached_embeddings(self, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        """Look up cached embeddings for these chunk hashes in one query"""
+        rows = []
+        with self._embedding_cache_lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows += self._embedding_cache.execute(
+                    f"SELECT chunk_sha256, embedding FROM embedding_cache WHERE model = ? AND chunk_sha256 IN ({placeholders})",
+                    [self.embedding_model, *batch]
+                ).fetchall()
+        return {
+            row[0]: np.frombuffer(row[1], dtype=EMBEDDING_CACHE_DTYPE).astype(np.float32).tolist()
+            for row in rows
+        }
+    
+    def _cache_embeddings(self, hashes: List[bytes], embeddings: List[List[float]]):
+        """Store new embeddings in the cache"""
+        rows = [
+            (chunk_hash, self.embedding_model, np.asarray(embedding, dtype=EMBEDDING_CACHE_DTYPE).tobytes())
+            for chunk_hash, embedding in zip(hashes, embeddings)
+        ]
+        with self._embedding_cache_lock, self._embedding_cache:
+            self._embedding_cache.executemany(
+                "INSERT OR IGNORE INTO embedding_cache (chunk_sha256, model, embedding) VALUES (?, ?, ?)",
+                rows
+            )
+    
+    async def generate_embeddings(self, texts: List[str], hashes: Optional[List[bytes]] = None) -> List[List[float]]:
         """
-        Generate embeddings using Google's text-embedding-004 model
+        Generate embeddings using Google's text-embedding-004 model, reusing cached ones.
+        Pass the texts' SHA-256 digests as hashes if the caller already computed them.
         """
         try:
-            embeddings = []
-            
-            for text in texts:
-                # Skip empty chunks
-                if not text.strip():
-                    continue
-                    
-                # Generate embedding for each text chunk
-                result = genai.embed_content(
+            if hashes is None:
+                hashes = _hash_chunks(texts)
+            
+            # Skip empty chunks
+            non_empty = [(text, chunk_hash) for text, chunk_hash in zip(texts, hashes) if text.strip()]
+            non_empty_texts = [text for text, _ in non_empty]
+            hashes = [chunk_hash for _, chunk_hash in non_empty]
+            
+            # SQLite calls are blocking too, so they also run in a thread
+            cached = await asyncio.to_thread(self._get_cached_embeddings, list(set(hashes)))
+            misses = {}
+            for text, chunk_hash in zip(non_empty_texts, hashes):
+                if chunk_hash not in cached:
+                    misses.setdefault(chunk_hash, text)
+            miss_hashes = list(misses)
+            miss_texts = list(misses.values())
+            
+            # One request per batch of chunks instead of one per chunk. The SDK call is
+            # blocking, so batches run concurrently in threads; gather keeps input order
+            batches = [
+                miss_texts[start:start + EMBED_BATCH_SIZE]
+                for start in range(0, len(miss_texts), EMBED_BATCH_SIZE)
+            ]
+            results = await asyncio.gather(*[
+                asyncio.to_thread(
+                    genai.embed_content,
                     model=self.embedding_model,
-                    content=text,
+                    content=batch,
                     task_type="retrieval_document"
                 )
-                
+                for batch in batches
+            ])
+            
+            new_embeddings = []
+            for batch, result in zip(batches, results):
                 # Handle different response formats
                 if isinstance(result, dict) and 'embedding' in result:
-                    embeddings.append(result['embedding'])
+                    batch_embeddings = result['embedding']
                 elif hasattr(result, 'embedding'):
-                    embeddings.append(result.embedding)
+                    batch_embeddings = result.embedding
                 else:
-                    logger.warning(f"Unexpected embedding result format: {type(result)}")
-                    continue
+                    raise Exception(f"Unexpected embedding result format: {type(result)}")
+                
+                if len(batch_embeddings) != len(batch):
+                    raise Exception(f"Got {len(batch_embeddings)} embeddings for a batch of {len(batch)} texts")
+                new_embeddings.extend(batch_embeddings)
             
-            logger.info(f"Generated {len(embeddings)} embeddings from {len(texts)} texts")
+            if new_embeddings:
+                await asyncio.to_thread(self._cache_embeddings, miss_hashes, new_embeddings)
+                cached.update(zip(miss_hashes, new_embeddings))
+            
+            embeddings = [cached[chunk_hash] for chunk_hash in hashes]
+            logger.info(f"Generated {len(new_embeddings)} embeddings ({len(embeddings) - len(new_embeddings)} cached) "
+                        f"from {len(texts)} texts")
             return embeddings
             
         except Exception as e:
             logger.error(f"Error generating embeddings: {str(e)}")
             raise Exception(f"Failed to generate embeddings: {str(e)}")
     
-    async def store_vectors(self, file_id: str, chunks: List[str], embeddings: List[List[float]]) -> bool:
+    async def store_vectors(self, file_id: str, chunks: List[str], embeddings: List[List[float]],
+                            chunk_hashes: Optional[List[bytes]] = None) -> bool:
         """
         Store vectors in ChromaDB
         """
@@ -128,6 +215,9 @@ class VectorProcessingService:
                 logger.error(f"Mismatch: {len(chunks)} chunks vs {len(embeddings)} embeddings")
                 raise Exception("Number of chunks and embeddings don't match")
             
+            if chunk_hashes is None:
+                chunk_hashes = _hash_chunks(chunks)
+            
             # Skip empty chunks and embeddings
             valid_data = []
             for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
@@ -155,12 +245,14 @@ class VectorProcessingService:
                     "file_id": file_id,
                     "chunk_index": i,
                     "text_length": len(chunk),
-                    "chunk_hash": hashlib.md5(chunk.encode()).hexdigest()
+                    "chunk_hash": chunk_hashes[i].hex()
                 })
             
-            # Add to ChromaDB collection with proper typing
-            self.collection.add(
-                embeddings=valid_embeddings,  # This should be List[List[float]]
+            # Add to ChromaDB collection with proper typing, in one call off the event loop
+            await asyncio.to_thread(
+                self.collection.add,
+                # One contiguous float32 array instead of lists of 8-byte Python floats
+                embeddings=np.asarray(valid_embeddings, dtype=np.float32),
                 documents=valid_chunks,
                 metadatas=metadatas,
                 ids=ids
@@ -188,15 +280,16 @@ class VectorProcessingService:
                 raise Exception("No text content to process")
             
             # Step 1: Chunk the text
-            chunks = self.chunk_text(text)
+            chunks = await self.chunk_text_async(text)
             if not chunks:
                 logger.warning(f"No valid chunks generated for file {file_id}")
                 raise Exception("No valid text chunks generated")
             
             logger.info(f"Generated {len(chunks)} chunks for file {file_id}")
             
-            # Step 2: Generate embeddings
-            embeddings = await self.generate_embeddings(chunks)
+            # Step 2: Generate embeddings (each chunk is hashed once, for the cache and metadata)
+            chunk_hashes = _hash_chunks(chunks)
+            embeddings = await self.generate_embeddings(chunks, chunk_hashes)
             if not embeddings:
                 logger.warning(f"No embeddings generated for file {file_id}")
                 raise Exception("No embeddings generated")
@@ -204,7 +297,7 @@ class VectorProcessingService:
             logger.info(f"Generated {len(embeddings)} embeddings for file {file_id}")
             
             # Step 3: Store vectors
-            await self.store_vectors(file_id, chunks, embeddings)
+            await self.store_vectors(file_id, chunks, embeddings, chunk_hashes)
             
             logger.info(f"Successfully completed vector processing for file {file_id}")
             return True
@@ -219,7 +312,8 @@ class VectorProcessingService:
         """
         try:
             # Generate embedding for query
-            query_embedding = genai.embed_content(
+            query_embedding = await asyncio.to_thread(
+                genai.embed_content,
                 model=self.embedding_model,
                 content=query,
                 task_type="retrieval_query"
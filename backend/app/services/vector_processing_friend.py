@@ -1,9 +1,13 @@
 import asyncio
+import json
 import logging
-import tempfile
+import uuid
 import os
+import aiofiles
+import aiofiles.tempfile
 from typing import Dict, Any
-from llama_index.core import Document
+from llama_index.core import Document, Settings
+from llama_index.core.schema import MetadataMode
 from app.services.vector_search import get_vector_search_service
 
 logger = logging.getLogger(__name__)
@@ -22,21 +26,20 @@ class FriendVectorProcessingService:
         Process a PDF file using friend's LlamaIndex approach
         """
         try:
-            # Save file content to temporary file for LlamaParse
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            logger.info(f"Processing {filename} with friend's LlamaIndex approach")
-            
-            # Use friend's upload method
-            result = self.vector_service.upload_pdfs([temp_file_path])
-            
-            # Clean up temporary file
-            os.unlink(temp_file_path)
+            # Spool the bytes once, under the original filename so the indexed file_name
+            # matches what _update_document_metadata looks up
+            async with aiofiles.tempfile.TemporaryDirectory() as temp_dir:
+                temp_file_path = os.path.join(temp_dir, os.path.basename(filename))
+                async with aiofiles.open(temp_file_path, "wb") as temp_file:
+                    await temp_file.write(file_content)
+                
+                logger.info(f"Processing {filename} with friend's LlamaIndex approach")
+                
+                # Use friend's upload method; parsing and indexing block, so run them in a thread
+                result = await asyncio.to_thread(self.vector_service.upload_pdfs, [temp_file_path])
             
             # Update the metadata for the uploaded documents with our file_id
-            await self._update_document_metadata(file_id, filename)
+            await self._update_document_metadata(file_id, os.path.basename(filename))
             
             logger.info(f"Successfully processed {filename} using friend's system")
             return result
@@ -50,27 +53,24 @@ class FriendVectorProcessingService:
         Update document metadata to include our file_id
         """
         try:
-            # Get all documents from the collection
+            # Get the documents for this filename from the collection
             collection = self.vector_service.chroma_collection
-            all_docs = collection.get(include=["metadatas"])
+            docs = await asyncio.to_thread(
+                collection.get, where={"file_name": filename}, include=["metadatas"]
+            )
             
-            # Find documents that match the filename and don't have our file_id
-            if all_docs.get("metadatas"):
-                for i, metadata in enumerate(all_docs["metadatas"]):
-                    if (metadata and 
-                        metadata.get("file_name") == filename and 
-                        not metadata.get("original_file_id")):
-                        
-                        # Update metadata to include our file_id
-                        doc_id = all_docs["ids"][i]
-                        updated_metadata = {**metadata, "original_file_id": file_id}
-                        
-                        collection.update(
-                            ids=[doc_id],
-                            metadatas=[updated_metadata]
-                        )
-                        logger.info(f"Updated metadata for document {doc_id} with file_id {file_id}")
-                        
+            # Collect every document that doesn't have our file_id yet, then update them in one call
+            update_ids = []
+            update_metadatas = []
+            for doc_id, metadata in zip(docs.get("ids") or [], docs.get("metadatas") or []):
+                if metadata and not metadata.get("original_file_id"):
+                    update_ids.append(doc_id)
+                    update_metadatas.append({**metadata, "original_file_id": file_id})
+            
+            if update_ids:
+                await asyncio.to_thread(collection.update, ids=update_ids, metadatas=update_metadatas)
+                logger.info(f"Updated metadata for {len(update_ids)} documents with file_id {file_id}")
+                
         except Exception as e:
             logger.warning(f"Could not update document metadata: {str(e)}")
     
@@ -87,16 +87,14 @@ class FriendVectorProcessingService:
                 metadata={"file_id": file_id, "file_name": f"text_document_{file_id}"}
             )
             
-            # Add to friend's index directly
-            if self.vector_service.index is None:
-                from llama_index.core import VectorStoreIndex
-                self.vector_service.index = VectorStoreIndex.from_documents(
-                    [document], 
-                    storage_context=self.vector_service.storage_context
-                )
-            else:
-                # Add to existing index
-                self.vector_service.index.insert(document)
+            # A retried or recovered file may already have some or all of its chunks indexed;
+            # drop them first so the file is never indexed twice
+            await asyncio.to_thread(
+                self.vector_service.chroma_collection.delete, where={"file_id": file_id}
+            )
+            
+            # Chunking and embedding block, so they run off the event loop
+            await asyncio.to_thread(self._index_document, document)
             
             logger.info(f"Successfully processed text for file_id {file_id}")
             return {"status": "success", "message": "Text processed successfully"}
@@ -105,5 +103,66 @@ class FriendVectorProcessingService:
             logger.error(f"Error processing text for file_id {file_id}: {str(e)}")
             raise
 
+    async def copy_file_vectors(self, source_file_id: str, target_file_id: str) -> int:
+        """
+        Copy the stored chunks of an already processed file to another file_id, reusing their
+        embeddings. Returns the number of chunks copied.
+        """
+        return await asyncio.to_thread(self._copy_file_vectors, source_file_id, target_file_id)
+    
+    def _copy_file_vectors(self, source_file_id: str, target_file_id: str) -> int:
+        collection = self.vector_service.chroma_collection
+        # Copying again after a failed attempt replaces, rather than duplicates, the chunks
+        collection.delete(where={"file_id": target_file_id})
+        source = collection.get(
+            where={"file_id": source_file_id},
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not source["ids"]:
+            return 0
+        
+        ids = []
+        metadatas = []
+        for metadata in source["metadatas"]:
+            node_id = str(uuid.uuid4())
+            metadata = {**metadata, "file_id": target_file_id, "file_name": f"text_document_{target_file_id}"}
+            # LlamaIndex rebuilds nodes from the serialized copy, so it needs the new ids too
+            if "_node_content" in metadata:
+                node = json.loads(metadata["_node_content"])
+                node["id_"] = node_id
+                node.setdefault("metadata", {}).update(
+                    file_id=target_file_id, file_name=f"text_document_{target_file_id}"
+                )
+                metadata["_node_content"] = json.dumps(node)
+            ids.append(node_id)
+            metadatas.append(metadata)
+        
+        collection.add(
+            ids=ids,
+            embeddings=source["embeddings"],
+            documents=source["documents"],
+            metadatas=metadatas
+        )
+        return len(ids)
+    
+    def _index_document(self, document: Document):
+        """
+        Add a document to friend's index, creating the index on first use. Chunks that repeat
+        within the document (headers, footers, boilerplate clauses) are embedded only once.
+        """
+        nodes = Settings.node_parser.get_nodes_from_documents([document])
+        # The same text LlamaIndex would embed for each node, metadata included
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        unique_texts = list(dict.fromkeys(texts))
+        embeddings = dict(zip(unique_texts, Settings.embed_model.get_text_embedding_batch(unique_texts)))
+        for node, text in zip(nodes, texts):
+            node.embedding = embeddings[text]
+        if len(unique_texts) < len(texts):
+            logger.info(f"Embedded {len(unique_texts)} unique chunks for {len(texts)} chunks "
+                        f"of {document.metadata.get('file_id')}")
+        
+        # Nodes that already carry an embedding are stored without calling the model again
+        self.vector_service.get_or_create_index().insert_nodes(nodes)
+
 # Create the service instance
 friend_vector_processing_service = FriendVectorProcessingService()
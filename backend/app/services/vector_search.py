@@ -4,10 +4,13 @@ import json
 import re
 import logging
 import asyncio
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 from llama_parse import LlamaParse, ResultType
 from llama_index.core import VectorStoreIndex, Settings, StorageContext
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
 from llama_index.llms.google_genai import GoogleGenAI
@@ -17,10 +20,22 @@ from app.config import settings
 logger = logging.getLogger(__name__)
 
 # --- SETTINGS ---
-Settings.embed_model = GoogleGenAIEmbedding(model_name="text-embedding-004", embed_batch_size=32)
+Settings.embed_model = GoogleGenAIEmbedding(model_name="text-embedding-004", embed_batch_size=100)
 Settings.chunk_size = 1024
 Settings.chunk_overlap = 200
 
+# ```json ... ``` or ``` ... ``` fences around the model's answer
+_CODE_FENCE_RE = re.compile(r"```(?:json)?\n(.*?)```", re.DOTALL)
+
+# Chunks retrieved per query; MMR re-ranks them pairwise and all of them go into the prompt
+SIMILARITY_TOP_K = 15
+
+# Query engines kept for reuse, keyed by (file_id, top_k)
+QUERY_ENGINE_CACHE_SIZE = 256
+
+# LlamaParse jobs in flight at once per upload_pdfs call
+PARSE_CONCURRENCY = 8
+
 class VectorSearchService:
     def __init__(self):
         # --- PERSISTENT STORAGE ---
@@ -32,6 +47,11 @@ class VectorSearchService:
         
         # Load index and LLM once at module load
         self.index = None
+        # Guards creating the index when the first documents are indexed from several threads
+        self._index_lock = threading.Lock()
+        # Engines read the live collection, so they stay valid as documents are inserted
+        self._engine_cache: OrderedDict = OrderedDict()
+        self._engine_lock = threading.Lock()
         if self.chroma_collection.count() > 0:
             self.index = VectorStoreIndex.from_vector_store(self.vector_store, storage_context=self.storage_context)
             logger.info(f"Loaded existing index with {self.chroma_collection.count()} documents")
@@ -54,22 +74,38 @@ class VectorSearchService:
     def upload_pdfs(self, file_paths: List[str]) -> Dict[str, Any]:
         """
         Upload and index a list of PDF files into Chroma.
+        Callers run this in a worker thread, so the parses get an event loop of their own.
         """
+        return asyncio.run(self._upload_pdfs_async(file_paths))
+
+    async def _upload_pdfs_async(self, file_paths: List[str]) -> Dict[str, Any]:
+        """Parse every file concurrently, then index the results"""
         try:
-            docs = []
+            semaphore = asyncio.Semaphore(PARSE_CONCURRENCY)
+
+            async def parse(file_path: str):
+                async with semaphore:
+                    logger.info(f"Processing {os.path.basename(file_path)}...")
+                    return await self.parser.aload_data(file_path)
+
+            # Each parse is a LlamaParse round-trip, so keep several in flight
+            parsed = await asyncio.gather(*[parse(file_path) for file_path in file_paths])
 
-            # Load and prepare documents
-            for file_path in file_paths:
+            # Load and prepare documents; gather keeps results in input order
+            docs = []
+            for file_path, documents in zip(file_paths, parsed):
                 filename = os.path.basename(file_path)
-                logger.info(f"Processing {filename}...")
-                documents = self.parser.load_data(file_path)
                 file_id = str(uuid.uuid4().hex[:8])
                 for d in documents:
                     d.metadata = {"file_id": file_id, "file_name": filename}
                 docs.extend(documents)
 
             if docs:
-                self.index = VectorStoreIndex.from_documents(docs, storage_context=self.storage_context)
+                # Only the new documents are chunked and embedded; earlier uploads stay as they are
+                nodes = Settings.node_parser.get_nodes_from_documents(docs)
+                # Similar-length chunks end up in the same embedding batch
+                nodes.sort(key=lambda node: len(node.get_content()), reverse=True)
+                self.get_or_create_index().insert_nodes(nodes)
                 return {"status": "success", "message": f"{len(file_paths)} file(s) uploaded and indexed."}
             else:
                 return {"status": "empty", "message": "No valid PDF files to upload."}
@@ -78,7 +114,41 @@ class VectorSearchService:
             logger.error(f"Error uploading PDFs: {str(e)}")
             return {"status": "error", "message": f"An error occurred while uploading: {str(e)}"}
     
-    async def query_file_contracts(self, file_id: str, query: str) -> Dict[str, Any]:
+    def get_or_create_index(self) -> VectorStoreIndex:
+        """Return the index, creating an empty one over the collection on first use"""
+        with self._index_lock:
+            if self.index is None:
+                self.index = VectorStoreIndex([], storage_context=self.storage_context)
+            return self.index
+
+    def _get_query_engine(self, top_k: int, file_id: Optional[str] = None):
+        """Return a cached MMR query engine, limited to one file when file_id is given"""
+        key = (file_id, top_k)
+        with self._engine_lock:
+            engine = self._engine_cache.get(key)
+            if engine is not None:
+                self._engine_cache.move_to_end(key)
+                return engine
+
+        filters = None
+        if file_id is not None:
+            filters = MetadataFilters(filters=[ExactMatchFilter(key="file_id", value=file_id)])
+        engine = self.index.as_query_engine(
+            llm=self.llm,
+            similarity_top_k=top_k,
+            vector_store_query_mode="mmr",
+            alpha=0.5,
+            filters=filters
+        )
+
+        with self._engine_lock:
+            engine = self._engine_cache.setdefault(key, engine)
+            self._engine_cache.move_to_end(key)
+            if len(self._engine_cache) > QUERY_ENGINE_CACHE_SIZE:
+                self._engine_cache.popitem(last=False)
+        return engine
+
+    async def query_file_contracts(self, file_id: str, query: str, top_k: int = SIMILARITY_TOP_K) -> Dict[str, Any]:
         """
         Query the indexed documents for contract information.
         Uses the original friend's implementation with file_id filtering.
@@ -96,13 +166,8 @@ class VectorSearchService:
                     "search_time_ms": (datetime.now() - start_time).total_seconds() * 1000
                 }
 
-            # Create query engine with friend's exact parameters
-            query_engine = self.index.as_query_engine(
-                llm=self.llm,
-                similarity_top_k=95,
-                vector_store_query="mmr",
-                alpha=0.5
-            )
+            # Chroma only searches the requested file's chunks
+            query_engine = self._get_query_engine(top_k, file_id)
             
             # Enhanced query with file_id context
             enhanced_query = f"For file with file_id {file_id}, answer this question: {query}"
@@ -119,7 +184,7 @@ class VectorSearchService:
             response_str = str(response)
 
             # Remove ```json ... ``` or ``` ... ``` code blocks (friend's cleaning logic)
-            cleaned_str = re.sub(r"```(?:json)?\n(.*?)```", r"\1", response_str, flags=re.DOTALL).strip()
+            cleaned_str = _CODE_FENCE_RE.sub(r"\1", response_str).strip()
 
             # Try to parse as JSON
             try:
@@ -128,20 +193,18 @@ class VectorSearchService:
                 # Fallback: return as a string if parsing fails
                 data_json = {"raw_response": cleaned_str}
 
-            # Extract sources with file filtering
+            # Extract sources; the retriever already limited them to the requested file
             sources = []
             if hasattr(response, 'source_nodes'):
                 for node in response.source_nodes:
                     if hasattr(node, 'metadata'):
                         metadata = node.metadata
-                        # Only include sources from requested file
-                        if metadata.get('file_id') == file_id:
-                            sources.append({
-                                "chunk_id": metadata.get('chunk_id', 'unknown'),
-                                "file_name": metadata.get('file_name', 'unknown'),
-                                "page": metadata.get('page', 'unknown'),
-                                "score": getattr(node, 'score', 0.0)
-                            })
+                        sources.append({
+                            "chunk_id": metadata.get('chunk_id', 'unknown'),
+                            "file_name": metadata.get('file_name', 'unknown'),
+                            "page": metadata.get('page', 'unknown'),
+                            "score": getattr(node, 'score', 0.0)
+                        })
 
             search_time = (datetime.now() - start_time).total_seconds() * 1000
             
@@ -166,7 +229,7 @@ class VectorSearchService:
                 "search_time_ms": round(search_time, 2)
             }
 
-    def query_contracts(self, prompt: str) -> Dict[str, Any]:
+    def query_contracts(self, prompt: str, top_k: int = SIMILARITY_TOP_K) -> Dict[str, Any]:
         """
         Query the indexed documents for contract information.
         This is your friend's original implementation for general queries.
@@ -175,17 +238,12 @@ class VectorSearchService:
             return {"status": "error", "message": "No documents indexed. Please upload PDFs first."}
 
         try:
-            query_engine = self.index.as_query_engine(
-                llm=self.llm,
-                similarity_top_k=95,
-                vector_store_query="mmr",
-                alpha=0.5
-            )
+            query_engine = self._get_query_engine(top_k)
             response = query_engine.query(prompt)
             response_str = str(response)
 
             # Remove ```json ... ``` or ``` ... ``` code blocks
-            cleaned_str = re.sub(r"```(?:json)?\n(.*?)```", r"\1", response_str, flags=re.DOTALL).strip()
+            cleaned_str = _CODE_FENCE_RE.sub(r"\1", response_str).strip()
 
             # Try to parse as JSON
             try:
@@ -7,6 +7,8 @@ from app.routers import files
 from app.routers import search_simple as search
 from app.routers import websocket
 from app.services.processing_queue import ProcessingQueue
+from app.services.metadata_extraction import close_http_client
+from app.services.pdf_processing import pdf_processing_service
 from app.utils.logging import setup_logging
 from app.utils.exceptions import (
     global_exception_handler,
@@ -39,6 +41,8 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down...")
     await processing_queue.stop()
+    await close_http_client()
+    await pdf_processing_service.close()
 
 app = FastAPI(
     title="Contract Processing API",
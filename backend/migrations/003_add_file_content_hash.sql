@@ -0,0 +1,6 @@
+-- Migration: Add content hash to files table
+-- Date: 2026-10-16
+-- Purpose: Detect re-uploads of already processed PDFs and reuse their vectors and metadata
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash VARCHAR;
+CREATE INDEX IF NOT EXISTS ix_files_content_hash ON files (content_hash);
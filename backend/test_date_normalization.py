@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Regression table for MetadataExtractionService._normalize_date.
+Covers every format the original strptime pattern list accepted, plus the
+ordinal, ambiguous and invalid cases the regex classifier has to get right.
+Also checks that _parse_ddmmyyyy accepts exactly what strptime("%d-%m-%Y") did.
+"""
+from datetime import datetime
+
+from app.services.metadata_extraction import MetadataExtractionService, _parse_ddmmyyyy
+
+# (input, expected DD-MM-YYYY output - or the input itself when it isn't a date)
+DATE_CASES = [
+    # Not provided
+    ("NA", "NA"),
+    ("n/a", "NA"),
+    ("", "NA"),
+    ("  ", "NA"),
+
+    # %Y-%m-%d, %Y/%m/%d, %Y.%m.%d
+    ("2024-12-31", "31-12-2024"),
+    ("2024-1-5", "05-01-2024"),
+    ("2024/12/31", "31-12-2024"),
+    ("2024.12.31", "31-12-2024"),
+
+    # %d-%m-%Y, %d/%m/%Y, %d.%m.%Y
+    ("31-12-2024", "31-12-2024"),
+    ("5-1-2024", "05-01-2024"),
+    ("31/12/2024", "31-12-2024"),
+    ("31.12.2024", "31-12-2024"),
+    ("  31-12-2024 ", "31-12-2024"),
+    ("29-02-2024", "29-02-2024"),
+
+    # %m-%d-%Y, %m/%d/%Y - only when the day-first reading is impossible
+    ("12-31-2024", "31-12-2024"),
+    ("12/31/2024", "31-12-2024"),
+
+    # Ambiguous MM/DD vs DD/MM: day-first wins, as %d-%m-%Y was tried before %m-%d-%Y
+    ("01/02/2024", "01-02-2024"),
+    ("03-04-2024", "03-04-2024"),
+    ("12/11/2024", "12-11-2024"),
+
+    # Dotted dates were only ever day-first (there was no %m.%d.%Y)
+    ("12.31.2024", "12.31.2024"),
+
+    # %B %d, %Y and %b %d, %Y
+    ("December 31, 2024", "31-12-2024"),
+    ("Dec 31, 2024", "31-12-2024"),
+    ("december 5, 2024", "05-12-2024"),
+    ("DEC 5, 2024", "05-12-2024"),
+    ("December  31,  2024", "31-12-2024"),
+
+    # %d %B %Y and %d %b %Y
+    ("31 December 2024", "31-12-2024"),
+    ("31 Dec 2024", "31-12-2024"),
+    ("1 may 2024", "01-05-2024"),
+
+    # Ordinal suffixes
+    ("December 31st, 2024", "31-12-2024"),
+    ("Dec 2nd, 2024", "02-12-2024"),
+    ("March 3rd, 2024", "03-03-2024"),
+    ("1st January 2024", "01-01-2024"),
+    ("22nd Feb 2024", "22-02-2024"),
+    ("4th July 2024", "04-07-2024"),
+
+    # Invalid calendar dates are returned unchanged
+    ("2024-02-30", "2024-02-30"),
+    ("30-02-2024", "30-02-2024"),
+    ("29-02-2023", "29-02-2023"),
+    ("31/04/2024", "31/04/2024"),
+    ("13/13/2024", "13/13/2024"),
+    ("0-12-2024", "0-12-2024"),
+    ("February 30, 2024", "February 30, 2024"),
+    ("32 December 2024", "32 December 2024"),
+
+    # Formats the pattern list never accepted
+    ("Sept 5, 2024", "Sept 5, 2024"),
+    ("December 31 2024", "December 31 2024"),
+    ("31 December, 2024", "31 December, 2024"),
+    ("Q4 2024", "Q4 2024"),
+]
+
+# (input, expected datetime - or None when strptime("%d-%m-%Y") rejected it)
+PARSE_CASES = [
+    ("31-12-2024", datetime(2024, 12, 31)),
+    ("01-01-2020", datetime(2020, 1, 1)),
+    ("1-1-2024", datetime(2024, 1, 1)),
+    ("29-02-2024", datetime(2024, 2, 29)),
+    ("29-02-2023", None),
+    ("1-1-24", None),
+    ("05-06-124", None),
+    (" 12- 05-2024", None),
+    ("+1-02-2030", None),
+    ("31/12/2024", None),
+    ("NA", None),
+]
+
+
+def test_normalize_date():
+    failures = []
+    for date_string, expected in DATE_CASES:
+        actual = MetadataExtractionService._normalize_date(date_string)
+        if actual != expected:
+            failures.append(f"{date_string!r}: expected {expected!r}, got {actual!r}")
+    assert not failures, "\n".join(failures)
+
+
+def test_parse_ddmmyyyy():
+    failures = []
+    for date_string, expected in PARSE_CASES:
+        try:
+            actual = _parse_ddmmyyyy(date_string)
+        except ValueError:
+            actual = None
+        if actual != expected:
+            failures.append(f"{date_string!r}: expected {expected!r}, got {actual!r}")
+    assert not failures, "\n".join(failures)
+
+
+def test_unparseable_end_date_is_draft():
+    service = MetadataExtractionService()
+    metadata = {"vendor_name": "Acme Corp"}
+    for end_date in ("1-1-24", "05-06-124", " 12- 05-2024", "+1-02-2030"):
+        assert service._calculate_contract_status_and_tag("01-01-2020", end_date, metadata) == ("Draft", "NA")
+
+
+if __name__ == "__main__":
+    print("Testing date normalization:")
+    print("-" * 60)
+
+    failed = 0
+    for date_string, expected in DATE_CASES:
+        actual = MetadataExtractionService._normalize_date(date_string)
+        status = "ok" if actual == expected else "FAIL"
+        failed += actual != expected
+        print(f"{status:4}  {date_string!r:24} -> {actual!r}")
+
+    print("-" * 60)
+    print(f"{len(DATE_CASES) - failed}/{len(DATE_CASES)} cases passed")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Streamed Gemini responses in MetadataExtractionService._stream_json_response.
+Blocked or empty streams must fail extraction instead of parsing as all-"NA" metadata,
+blocks as permanent (not retried) errors. The closing finish-reason chunk of a normal
+stream is skipped.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import google.generativeai as genai
+import pytest
+
+from app.services.metadata_extraction import MetadataExtractionService
+from app.utils.exceptions import ProcessingException
+
+FinishReason = genai.protos.Candidate.FinishReason
+BlockReason = genai.protos.GenerateContentResponse.PromptFeedback.BlockReason
+
+
+def text_chunk(text, finish_reason=FinishReason.FINISH_REASON_UNSPECIFIED):
+    candidate = SimpleNamespace(
+        content=SimpleNamespace(parts=[SimpleNamespace(text=text)]), finish_reason=finish_reason
+    )
+    return SimpleNamespace(candidates=[candidate], text=text)
+
+
+def empty_chunk(finish_reason):
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[]), finish_reason=finish_reason)
+    return SimpleNamespace(candidates=[candidate])
+
+
+def blocked_chunk(block_reason):
+    return SimpleNamespace(candidates=[], prompt_feedback=SimpleNamespace(block_reason=block_reason))
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate_content_async(self, prompt, stream=False):
+        return FakeStream(self.chunks)
+
+
+def extract(chunks):
+    service = MetadataExtractionService()
+    service.model = FakeModel(chunks)
+    return asyncio.run(service.extract_metadata("Short contract text", "test-file"))
+
+
+@pytest.mark.parametrize("chunks, reason", [
+    ([blocked_chunk(BlockReason.SAFETY)], "SAFETY"),
+    ([empty_chunk(FinishReason.SAFETY)], "SAFETY"),
+    ([empty_chunk(FinishReason.RECITATION)], "RECITATION"),
+    ([text_chunk('{"contract_name": '), empty_chunk(FinishReason.SAFETY)], "SAFETY"),
+    ([empty_chunk(FinishReason.STOP)], "STOP"),
+])
+def test_blocked_stream_fails_permanently(chunks, reason):
+    with pytest.raises(Exception, match=f"Failed to extract metadata.*{reason}") as excinfo:
+        extract(chunks)
+    # The processing queue walks the exception chain and won't retry a ProcessingException
+    assert isinstance(excinfo.value.__context__, ProcessingException)
+
+
+def test_empty_stream_fails():
+    with pytest.raises(Exception, match="Failed to extract metadata.*empty response") as excinfo:
+        extract([])
+    assert not isinstance(excinfo.value.__context__, ProcessingException)
+
+
+def test_closing_chunk_is_skipped():
+    metadata = extract([
+        text_chunk('{"contract_name": "Master Services'),
+        text_chunk(' Agreement", "vendor_name": "Acme Corp"}'),
+        empty_chunk(FinishReason.STOP),
+    ])
+    assert metadata["contract_name"] == "Master Services Agreement"
+    assert metadata["vendor_name"] == "Acme Corp"
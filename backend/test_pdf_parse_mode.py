@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+LlamaParse mode selection in PDFProcessingService.extract_text_from_file.
+Born-digital pages are read locally, short-but-real text layers use fast mode, and any
+page with a thin text layer (a stamp on a scanned image) keeps OCR on.
+"""
+import asyncio
+
+import pytest
+
+from app.services import pdf_processing
+from app.services.pdf_processing import (
+    ACCURATE_PARSE_OPTIONS,
+    FAST_PARSE_OPTIONS,
+    PDFProcessingService,
+)
+
+BODY_PAGE = "This Master Services Agreement is entered into by and between the parties below. " * 3
+SHORT_PAGE = "IN WITNESS WHEREOF, the parties have signed this Agreement."
+STAMP_PAGE = "ACME-000123"
+
+
+def extract(tmp_path, monkeypatch, page_texts):
+    """Run extract_text_from_file with a fake text layer, returning the parse options used (or None)"""
+    monkeypatch.setattr(pdf_processing.settings, "parse_cache_directory", str(tmp_path / "cache"))
+    pdf_path = tmp_path / "contract.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fake")
+
+    service = PDFProcessingService()
+    used = []
+
+    async def parse_with_retries(file_path, filename, parse_options, page_count=0):
+        used.append(parse_options)
+        return ["parsed text"]
+
+    monkeypatch.setattr(service, "_read_text_layer", lambda file_path: page_texts)
+    monkeypatch.setattr(service, "_parse_with_retries", parse_with_retries)
+    asyncio.run(service.extract_text_from_file(str(pdf_path), "contract.pdf"))
+    return used[0] if used else None
+
+
+@pytest.mark.parametrize("page_texts, expected", [
+    ([BODY_PAGE, BODY_PAGE], None),
+    ([BODY_PAGE, SHORT_PAGE], FAST_PARSE_OPTIONS),
+    ([BODY_PAGE, STAMP_PAGE, BODY_PAGE], ACCURATE_PARSE_OPTIONS),
+    ([STAMP_PAGE, STAMP_PAGE], ACCURATE_PARSE_OPTIONS),
+    ([BODY_PAGE, ""], ACCURATE_PARSE_OPTIONS),
+    ([], ACCURATE_PARSE_OPTIONS),
+])
+def test_parse_mode(tmp_path, monkeypatch, page_texts, expected):
+    assert extract(tmp_path, monkeypatch, page_texts) == expected
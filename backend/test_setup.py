@@ -81,7 +81,7 @@ def test_imports():
         ("app.services.cloudinary_service", "cloudinary_service"),
         ("app.services.pdf_processing", "pdf_processing_service"),
         ("app.services.vector_processing", "vector_processing_service"),
-        ("app.services.metadata_extraction", "metadata_extraction_service"),
+        ("app.services.metadata_extraction", "get_metadata_extraction_service"),
         ("app.services.processing_queue", "ProcessingQueue"),
         ("app.routers.files", "router"),
     ]